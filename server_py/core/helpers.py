@@ -3,20 +3,27 @@ import uuid
 import asyncio
 import hashlib
 import hmac
+import http.client
+import io
+import ssl
+import threading
 import time
 import signal
-import tempfile
+import shutil
 import json
+from functools import lru_cache
 from datetime import datetime, timezone, timedelta
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from pathlib import Path
-from urllib import request as urllib_request, error as urllib_error
-from urllib.parse import quote
+from urllib import error as urllib_error
+from urllib.parse import quote, urlsplit
+from urllib.response import addinfourl
 from fastapi import HTTPException
 from pydantic import BaseModel
 
 from server_py.utils.logger import get_logger, get_log_files, read_log_file
 from server_py.utils import config_store
+from server_py.utils.paths import CONFIG_DIR
 from server_py.services.duplicacy import service as duplicacy_service
 from server_py.core.remote_cache import (
     REMOTE_LIST_CACHE_TTL_SECONDS,
@@ -27,12 +34,21 @@ from server_py.core.remote_cache import (
     _remote_cache_key,
     _remote_cache_get,
     _remote_cache_set,
+    _remote_cache_get_bytes,
+    _schedule_remote_cache_save,
+    _pw_fingerprint,
+    single_flight,
 )
+from server_py.core.progress import (
+    OutputLines, ProgressSignal, ProgressFeed, OUTPUT_LINES_MAXLEN, SSE_RUNNING, SSE_DONE, SSE_KEEPALIVE_SECONDS, SSE_COALESCE_SECONDS,
+    sse_frame, split_output_chunks, sse_output_frames, restore_progress_events,
+)
+from server_py.core.responses import OrjsonResponse
 from server_py.models.schemas import (
     RepoCreate, BackupStart, BackupCancelRequest, RestoreRequest, StorageRestoreRequest,
     WasabiConnectionTest, WasabiSnapshotDetectRequest, RepoUpdate, StorageCreate, StorageUpdate
 )
-from .storage_helpers import (sanitize_storage, get_storage_by_id, get_repo_storage, get_primary_storage, describe_storage, get_storage_env, get_repo_duplicacy_password, build_wasabi_env, get_storage_record_env, build_wasabi_storage_url, resolve_repo_destination, infer_repo_destination_type, build_destination_from_update, build_destination_from_storage_ref, list_all_storages_for_ui, repo_matches_storage_record, normalize_storage_comparable_url)
+from .storage_helpers import (sanitize_storage, get_storage_by_id, get_repo_storage, get_primary_storage, describe_storage, get_storage_env, get_repo_duplicacy_password, build_wasabi_env, get_storage_record_env, get_storage_record_envs, build_wasabi_storage_url, resolve_repo_destination, infer_repo_destination_type, build_destination_from_update, build_destination_from_storage_ref, list_all_storages_for_ui, repo_matches_storage_record, matching_storage_records, normalize_storage_comparable_url)
 
 logger = get_logger("Helpers")
 
@@ -42,6 +58,13 @@ completed_backups: Dict[str, Dict[str, Any]] = {}
 active_backup_processes: Dict[str, Any] = {}
 scheduler_task: Optional[asyncio.Task] = None
 scheduler_running: bool = False
+# La detección de Snapshot IDs caduca antes que el resto de listados remotos.
+WASABI_SNAPSHOTS_CACHE_TTL_SECONDS = 600
+WASABI_PROBE_SNAPSHOT_ID = "duplimanager-probe"
+# Un lock por directorio de probe: init/list no se solapan aunque cambie la contraseña
+_wasabi_probe_locks: Dict[str, asyncio.Lock] = {}
+SCHEDULER_LOCK_PATH = CONFIG_DIR / "scheduler.lock"
+_scheduler_lock_file: Optional[Any] = None
 FIXED_DUPLICACY_THREADS = 16
 
 INTERNAL_SECRET_KEYS = {"_secrets", "wasabiAccessKey", "wasabiAccessId"}
@@ -91,8 +114,9 @@ def sanitize_repo(repo: Dict[str, Any]) -> Dict[str, Any]:
         sanitized.pop(key, None)
     # Resolver storage real por tipo + URL para no depender de storageRefId obsoleto.
     try:
-        explicit_storages = [s for s in list_all_storages_for_ui() if (s.get("source") or "managed") == "managed"]
-        resolved = next((s for s in explicit_storages if repo_matches_storage_record(repo, s)), None)
+        # Mismo criterio que el listado de storages (por nombre), pero vía índice en vez de recorrer todos.
+        managed = [s for s in matching_storage_records(repo) if (s.get("source") or "managed") == "managed"]
+        resolved = min(managed, key=lambda s: str(s.get("name") or "").lower()) if managed else None
         sanitized["resolvedStorageRefId"] = resolved.get("id") if resolved else None
         sanitized["storageRefIdStale"] = bool(
             repo.get("storageRefId") and sanitized["resolvedStorageRefId"] and repo.get("storageRefId") != sanitized["resolvedStorageRefId"]
@@ -104,14 +128,83 @@ def sanitize_repo(repo: Dict[str, Any]) -> Dict[str, Any]:
     return sanitized
 
 
+async def get_repo_by_id(repo_id: str) -> Optional[Dict[str, Any]]:
+    """Repo por id vía el índice cacheado por versión de config (solo lectura).
+
+    Si la caché está vigente no sale del event loop; si hay que recargar, la lectura va a un hilo.
+    """
+    cached = config_store.repositories.peek_map()
+    if cached is None:
+        cached = await asyncio.to_thread(config_store.repositories.read_as_map)
+    return cached[1].get(repo_id)
+
+
+# Caché de sanitize_repo por id: se reutiliza mientras el repo de origen no cambie
+# y storages siga en la misma versión (la resolución de storageRefId depende de ellos).
+_sanitize_repo_cache: Dict[str, Tuple[int, Dict[str, Any], Dict[str, Any]]] = {}
 
 
+def sanitize_repos_cached(repos: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Versión memoizada de sanitize_repo para listados. Los dicts devueltos son de solo lectura."""
+    storages_version = config_store.storages.version
+    out = []
+    seen = set()
+    for repo in repos:
+        repo_id = repo.get("id")
+        cached = _sanitize_repo_cache.get(repo_id) if repo_id else None
+        if cached is not None and cached[0] == storages_version and cached[1] == repo:
+            sanitized = cached[2]
+        else:
+            sanitized = sanitize_repo(repo)
+            if repo_id:
+                _sanitize_repo_cache[repo_id] = (storages_version, repo, sanitized)
+        if repo_id:
+            seen.add(repo_id)
+        out.append(sanitized)
+    for stale_id in [k for k in _sanitize_repo_cache if k not in seen]:
+        _sanitize_repo_cache.pop(stale_id, None)
+    return out
+
+
+# Caché de sanitize_storage por id: solo depende del propio registro (evita descifrar secretos en cada listado).
+_sanitize_storage_cache: Dict[str, Tuple[Dict[str, Any], Dict[str, Any]]] = {}
+
+
+def sanitize_storages_cached(storages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Versión memoizada de sanitize_storage para listados. Los dicts devueltos son de solo lectura."""
+    out = []
+    seen = set()
+    for storage in storages:
+        storage_id = storage.get("id")
+        cached = _sanitize_storage_cache.get(storage_id) if storage_id else None
+        if cached is not None and cached[0] == storage:
+            sanitized = cached[1]
+        else:
+            sanitized = sanitize_storage(storage)
+            if storage_id:
+                _sanitize_storage_cache[storage_id] = (storage, sanitized)
+        if storage_id:
+            seen.add(storage_id)
+        out.append(sanitized)
+    for stale_id in [k for k in _sanitize_storage_cache if k not in seen]:
+        _sanitize_storage_cache.pop(stale_id, None)
+    return out
 
 
 
 
 
 
+
+
+
+
+@lru_cache(maxsize=512)
+def normalized_abs_path(path: str) -> str:
+    """abspath + normcase memoizado, para comparar rutas (repo vs destino de restore)."""
+    return os.path.normcase(os.path.abspath(path))
+
+
 def summarize_path_selection(paths: Optional[List[str]]) -> str:
     items = [str(p or "").strip() for p in (paths or []) if str(p or "").strip()]
     if not items:
@@ -249,6 +342,16 @@ def normalize_repo_notifications_config(
     return {"healthchecks": hc, "email": mail}
 
 
+@lru_cache(maxsize=2)
+def _iso_second(ts_sec: int) -> str:
+    return datetime.fromtimestamp(ts_sec).isoformat()
+
+
+def iso_now_seconds() -> str:
+    """Hora local actual en ISO sin microsegundos; el texto se reutiliza dentro del mismo segundo."""
+    return _iso_second(int(time.time()))
+
+
 def _parse_iso_datetime(value: Any) -> Optional[datetime]:
     if not value:
         return None
@@ -261,7 +364,8 @@ def _parse_iso_datetime(value: Any) -> Optional[datetime]:
 async def scheduler_tick():
     from server_py.routers.backups import start_backup
     
-    repos_data = config_store.repositories.read()
+    # Solo se consulta la lista (lectura compartida por versión); los cambios van por atomic_update.
+    repos_data, _ = config_store.repositories.read_as_map()
     now = datetime.now()
 
     for repo in repos_data:
@@ -323,6 +427,35 @@ async def scheduler_tick():
 
 
 
+def acquire_scheduler_lock() -> bool:
+    """Lock exclusivo entre procesos sobre config/scheduler.lock: con varios workers solo uno ejecuta el scheduler.
+
+    El lock se conserva mientras viva el proceso. Retorna False si otro proceso ya lo tiene.
+    """
+    global _scheduler_lock_file
+    if _scheduler_lock_file is not None:
+        return True
+    try:
+        fh = open(SCHEDULER_LOCK_PATH, "a+b")
+    except OSError as e:
+        # Sin fichero de lock se mantiene el comportamiento de un único proceso
+        logger.warning(f"[Scheduler] No se pudo abrir {SCHEDULER_LOCK_PATH}: {e}")
+        return True
+    try:
+        if os.name == "nt":
+            import msvcrt
+            fh.seek(0)
+            msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        fh.close()
+        return False
+    _scheduler_lock_file = fh
+    return True
+
+
 async def scheduler_loop():
     global scheduler_running
     scheduler_running = True
@@ -374,8 +507,10 @@ async def build_backup_change_summary(
     storage_name: str,
     password: Optional[str],
     pre_latest_revision: Optional[int] = None,
+    extra_env: Optional[Dict[str, str]] = None,
 ) -> Dict[str, Any]:
-    extra_env = get_storage_env(repo, storage_name)
+    if extra_env is None:
+        extra_env = get_storage_env(repo, storage_name)
     list_result = await duplicacy_service.list_snapshots(
         repo["path"],
         password=password,
@@ -795,6 +930,8 @@ def _aws_sign(key: bytes, msg: str) -> bytes:
     return hmac.new(key, msg.encode("utf-8"), hashlib.sha256).digest()
 
 
+# La clave de firma SigV4 solo cambia con el día, la región y la clave: se reutiliza entre peticiones.
+@lru_cache(maxsize=64)
 def _aws_signature_key(secret_key: str, date_stamp: str, region: str, service: str) -> bytes:
     k_date = _aws_sign(("AWS4" + secret_key).encode("utf-8"), date_stamp)
     k_region = _aws_sign(k_date, region)
@@ -802,6 +939,10 @@ def _aws_signature_key(secret_key: str, date_stamp: str, region: str, service: s
     return _aws_sign(k_service, "aws4_request")
 
 
+# sha256 del cuerpo vacío (HEAD/GET): constante, no hace falta recalcularla.
+_EMPTY_PAYLOAD_SHA256 = hashlib.sha256(b"").hexdigest()
+
+
 def _wasabi_signed_request(
     *,
     endpoint: str,
@@ -820,7 +961,7 @@ def _wasabi_signed_request(
     t = datetime.now(timezone.utc)
     amz_date = t.strftime("%Y%m%dT%H%M%SZ")
     date_stamp = t.strftime("%Y%m%d")
-    payload_hash = hashlib.sha256(body).hexdigest()
+    payload_hash = hashlib.sha256(body).hexdigest() if body else _EMPTY_PAYLOAD_SHA256
 
     canonical_headers = (
         f"host:{host}\n"
@@ -853,15 +994,137 @@ def _wasabi_signed_request(
         f"SignedHeaders={signed_headers}, Signature={signature}"
     )
 
-    req = urllib_request.Request(url=url, data=(body if method in {"PUT", "POST"} else None), method=method)
-    req.add_header("Host", host)
-    req.add_header("x-amz-date", amz_date)
-    req.add_header("x-amz-content-sha256", payload_hash)
-    req.add_header("Authorization", authorization_header)
+    headers = {
+        "Host": host,
+        "x-amz-date": amz_date,
+        "x-amz-content-sha256": payload_hash,
+        "Authorization": authorization_header,
+    }
     if method in {"PUT", "POST"}:
-        req.add_header("Content-Length", str(len(body)))
-        req.add_header("Content-Type", "text/plain; charset=utf-8")
-    return urllib_request.urlopen(req, timeout=timeout)
+        headers["Content-Length"] = str(len(body))
+        headers["Content-Type"] = "text/plain; charset=utf-8"
+    return _wasabi_pooled_request(
+        host=host,
+        method=method,
+        url=url,
+        body=(body if method in {"PUT", "POST"} else None),
+        headers=headers,
+        timeout=timeout,
+    )
+
+
+# Conexiones HTTPS keep-alive reutilizables por endpoint Wasabi: evita un handshake TLS por prueba.
+# MAX_CONNECTIONS limita las peticiones simultáneas por endpoint (las pruebas llegan del pool de E/S
+# remota del router de sistema, 16 hilos, y de las validaciones de storage en el executor por defecto
+# de asyncio); IDLE, cuántas quedan abiertas para reutilizar.
+WASABI_POOL_MAX_CONNECTIONS_PER_HOST = 32
+WASABI_POOL_MAX_IDLE_PER_HOST = 8
+WASABI_CONNECT_TIMEOUT_SECONDS = 5
+_wasabi_idle_connections: Dict[str, List[http.client.HTTPSConnection]] = {}
+_wasabi_host_slots: Dict[str, threading.BoundedSemaphore] = {}
+_wasabi_pool_lock = threading.Lock()
+_wasabi_ssl_context: Optional[ssl.SSLContext] = None
+
+
+def _wasabi_acquire_connection(host: str, timeout: int) -> Tuple[http.client.HTTPSConnection, bool]:
+    """Conexión ociosa del pool (reused=True) o una nueva ya conectada."""
+    global _wasabi_ssl_context
+    with _wasabi_pool_lock:
+        idle = _wasabi_idle_connections.get(host)
+        conn = idle.pop() if idle else None
+        if conn is None and _wasabi_ssl_context is None:
+            _wasabi_ssl_context = ssl.create_default_context()
+    if conn is None:
+        # Conexión con timeout corto; después se aplica el de lectura de la petición.
+        conn = http.client.HTTPSConnection(host, timeout=min(timeout, WASABI_CONNECT_TIMEOUT_SECONDS), context=_wasabi_ssl_context)
+        try:
+            conn.connect()
+        except OSError:
+            conn.close()
+            raise
+        reused = False
+    else:
+        reused = True
+    conn.timeout = timeout
+    if conn.sock is not None:
+        try:
+            conn.sock.settimeout(timeout)
+        except OSError:
+            # Socket ya cerrado: http.client reconecta solo en request().
+            conn.close()
+    return conn, reused
+
+
+def _wasabi_release_connection(host: str, conn: http.client.HTTPSConnection) -> None:
+    with _wasabi_pool_lock:
+        idle = _wasabi_idle_connections.setdefault(host, [])
+        if len(idle) < WASABI_POOL_MAX_IDLE_PER_HOST:
+            idle.append(conn)
+            return
+    conn.close()
+
+
+def _wasabi_pooled_request(
+    *,
+    host: str,
+    method: str,
+    url: str,
+    body: Optional[bytes],
+    headers: Dict[str, str],
+    timeout: int,
+) -> Any:
+    """Petición sobre una conexión del pool con la misma interfaz que urlopen.
+
+    Devuelve una respuesta tipo urllib (context manager con .status/.headers) y lanza
+    urllib_error.HTTPError / URLError, así los llamadores conservan su manejo de errores.
+    """
+    parts = urlsplit(url)
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+    with _wasabi_pool_lock:
+        slots = _wasabi_host_slots.get(host)
+        if slots is None:
+            slots = _wasabi_host_slots[host] = threading.BoundedSemaphore(WASABI_POOL_MAX_CONNECTIONS_PER_HOST)
+    if not slots.acquire(timeout=timeout):
+        raise urllib_error.URLError("demasiadas peticiones simultáneas al endpoint Wasabi")
+    try:
+        for attempt in range(2):
+            reused = False
+            conn = None
+            try:
+                conn, reused = _wasabi_acquire_connection(host, timeout)
+                reused = reused and attempt == 0
+                conn.request(method, path, body=body, headers=headers)
+                resp = conn.getresponse()
+                data = resp.read()
+            except (http.client.HTTPException, OSError) as exc:
+                if conn is not None:
+                    conn.close()
+                if reused:
+                    # El servidor pudo cerrar las conexiones ociosas: se descartan y se reintenta una vez.
+                    with _wasabi_pool_lock:
+                        stale = _wasabi_idle_connections.pop(host, [])
+                    for idle_conn in stale:
+                        idle_conn.close()
+                    continue
+                raise urllib_error.URLError(exc)
+            if resp.will_close:
+                conn.close()
+            else:
+                _wasabi_release_connection(host, conn)
+            if resp.status >= 400:
+                raise urllib_error.HTTPError(url, resp.status, resp.reason, resp.headers, io.BytesIO(data))
+            return addinfourl(io.BytesIO(data), resp.headers, url, resp.status)
+        raise urllib_error.URLError("conexión cerrada por el servidor")
+    finally:
+        slots.release()
+
+
+# Resultados positivos de HEAD bucket por (endpoint, región, bucket, accessId, huella de accessKey):
+# editar un storage sin cambiar la conexión no repite la prueba de red dentro del TTL.
+# El dict se mantiene en orden de inserción (= antigüedad): se poda por delante, como mucho MAX entradas.
+WASABI_HEAD_BUCKET_CACHE_TTL_SECONDS = 60
+WASABI_HEAD_BUCKET_CACHE_MAX_ENTRIES = 256
+_wasabi_head_bucket_cache: Dict[Tuple[str, ...], Tuple[float, Dict[str, Any]]] = {}
 
 
 def test_wasabi_head_bucket(endpoint: str, region: str, bucket: str, access_id: str, access_key: str) -> Dict[str, Any]:
@@ -877,6 +1140,10 @@ def test_wasabi_head_bucket(endpoint: str, region: str, bucket: str, access_id:
         )
 
     url = f"https://{clean_endpoint}/{clean_bucket}"
+    cache_key = (clean_endpoint, clean_region, clean_bucket, access_id, _pw_fingerprint(access_key or ""))
+    cached = _wasabi_head_bucket_cache.get(cache_key)
+    if cached is not None and (time.monotonic() - cached[0]) < WASABI_HEAD_BUCKET_CACHE_TTL_SECONDS:
+        return dict(cached[1])
 
     try:
         with _wasabi_signed_request(
@@ -890,13 +1157,21 @@ def test_wasabi_head_bucket(endpoint: str, region: str, bucket: str, access_id:
             body=b"",
             timeout=10,
         ) as resp:
-            return {
+            result = {
                 "ok": True,
                 "status": getattr(resp, "status", 200),
                 "bucket": clean_bucket,
                 "endpoint": clean_endpoint,
                 "requestId": resp.headers.get("x-amz-request-id") or resp.headers.get("x-wasabi-request-id"),
             }
+            now = time.monotonic()
+            _wasabi_head_bucket_cache.pop(cache_key, None)
+            _wasabi_head_bucket_cache[cache_key] = (now, result)
+            for oldest_key, (checked_at, _) in list(_wasabi_head_bucket_cache.items()):
+                if len(_wasabi_head_bucket_cache) <= WASABI_HEAD_BUCKET_CACHE_MAX_ENTRIES and now - checked_at < WASABI_HEAD_BUCKET_CACHE_TTL_SECONDS:
+                    break
+                _wasabi_head_bucket_cache.pop(oldest_key, None)
+            return dict(result)
     except urllib_error.HTTPError as exc:
         detail = f"Wasabi respondió HTTP {exc.code}"
         try:
@@ -1046,7 +1321,8 @@ async def validate_wasabi_duplicacy_storage_access_if_initialized(
 ) -> Dict[str, Any]:
     dir_part = (directory or "").strip().strip("/")
     config_key = f"{dir_part}/config" if dir_part else "config"
-    has_config = wasabi_object_exists(
+    has_config = await asyncio.to_thread(
+        wasabi_object_exists,
         endpoint=endpoint,
         region=region,
         bucket=bucket,
@@ -1078,78 +1354,162 @@ async def validate_wasabi_duplicacy_storage_access_if_initialized(
     }
 
 
-async def do_detect_wasabi_snapshots(req):
-    from server_py.models.schemas import WasabiSnapshotDetectRequest
-    storage_url = build_wasabi_storage_url(req.region, req.endpoint, req.bucket, req.directory)
-    # Importante: Duplicacy usa la región como alias en la URL, así que el env debe coincidir
-    extra_env = build_wasabi_env(req.accessId, req.accessKey, req.region)
+async def check_wasabi_storage_access(
+    *,
+    endpoint: str,
+    region: str,
+    bucket: str,
+    directory: str,
+    access_id: str,
+    access_key: str,
+    duplicacy_password: Optional[str],
+) -> Dict[str, Any]:
+    """HEAD del bucket y validación del storage Duplicacy en paralelo.
+
+    Si falla el HEAD se propaga su error (como cuando se ejecutaban en secuencia) y se cancela la
+    validación, que es la parte lenta (lanza duplicacy); si no, se espera y se propaga su resultado.
+    """
+    validation_task = asyncio.ensure_future(
+        validate_wasabi_duplicacy_storage_access_if_initialized(
+            endpoint=endpoint,
+            region=region,
+            bucket=bucket,
+            directory=directory,
+            access_id=access_id,
+            access_key=access_key,
+            duplicacy_password=duplicacy_password,
+        )
+    )
+    try:
+        await asyncio.to_thread(test_wasabi_head_bucket, endpoint, region, bucket, access_id, access_key)
+    except BaseException:
+        validation_task.cancel()
+        # Recoger la cancelación (o el error) de la tarea para que no quede sin consumir.
+        await asyncio.gather(validation_task, return_exceptions=True)
+        raise
+    return await validation_task
+
 
+@lru_cache(maxsize=256)
+def _wasabi_snapshots_cache_key(storage_url: str, password: Optional[str]) -> str:
+    # La UI repite la detección sobre el mismo storage: la clave se deriva una vez por (URL, contraseña).
+    return _remote_cache_key("wasabi-snapshots", storage_url, _pw_fingerprint(password or ""))
+
+
+def _wasabi_detect_params(req: WasabiSnapshotDetectRequest) -> Dict[str, Any]:
+    storage_url = build_wasabi_storage_url(req.region, req.endpoint, req.bucket, req.directory)
     password = (req.password or "").strip() or None
-    cache_key = _remote_cache_key(
-        "wasabi-snapshots",
-        storage_url,
-        bool(password),
-        hashlib.sha256((password or "").encode("utf-8")).hexdigest() if password else "",
+    return {
+        "storage_url": storage_url,
+        # Duplicacy usa la región como alias en la URL: se exportan las variables de ambos alias
+        "extra_env": {**build_wasabi_env(req.accessId, req.accessKey, req.region), **build_wasabi_env(req.accessId, req.accessKey, "default")},
+        "password": password,
+        "cache_key": _wasabi_snapshots_cache_key(storage_url, password),
+    }
+
+
+def wasabi_snapshots_cache_key(req) -> str:
+    """Clave de caché (y de single-flight) de la detección de Snapshot IDs para esta petición."""
+    return _wasabi_snapshots_cache_key(
+        build_wasabi_storage_url(req.region, req.endpoint, req.bucket, req.directory),
+        (req.password or "").strip() or None,
     )
-    cached = _remote_cache_get(cache_key)
-    if cached is not None:
-        return cached
-    probe_snapshot_id = f"duplimanager-probe-{uuid.uuid4().hex[:8]}"
 
-    with tempfile.TemporaryDirectory(prefix="duplimanager-wasabi-probe-") as tmp_dir:
-        init_result = await duplicacy_service.init(
-            tmp_dir,
-            probe_snapshot_id,
-            storage_url,
-            password=password,
-            encrypt=(True if password else False),
-            extra_env=extra_env,
+
+def _wasabi_probe_dir(storage_url: str) -> Path:
+    # Un directorio por storage: .duplicacy/preferences sobrevive entre detecciones y evita repetir el init
+    return PROBES_DIR / f"wasabi-detect_{hashlib.blake2b(storage_url.encode('utf-8'), digest_size=8).hexdigest()}"
+
+
+def _raise_duplicacy_access_error(detail: str) -> None:
+    if "likely to have been initialized with a password before" in detail:
+        raise HTTPException(
+            status_code=400,
+            detail="Este storage de Duplicacy parece cifrado. Introduce la contraseña de Duplicacy y vuelve a detectar Snapshot IDs.",
         )
-        if init_result.get("code") != 0:
-            from fastapi import HTTPException
-            detail = (init_result.get("stdout") or init_result.get("stderr") or "No se pudo acceder al storage de Duplicacy")
-            if "likely to have been initialized with a password before" in detail:
-                raise HTTPException(
-                    status_code=400,
-                    detail="Este storage de Duplicacy parece cifrado. Introduce la contraseña de Duplicacy y vuelve a detectar Snapshot IDs.",
+    if "password is not correct" in detail.lower() or "invalid password" in detail.lower():
+        raise HTTPException(status_code=400, detail="La contraseña de Duplicacy no es correcta.")
+    raise HTTPException(status_code=400, detail=detail)
+
+
+async def _probe_wasabi_snapshots(storage_url: str, extra_env: Dict[str, str], password: Optional[str], cache_key: str) -> Dict[str, Any]:
+    probe_dir = _wasabi_probe_dir(storage_url)
+    lock = _wasabi_probe_locks.setdefault(str(probe_dir), asyncio.Lock())
+    async with lock:
+        if not (probe_dir / ".duplicacy" / "preferences").exists():
+            probe_dir.mkdir(parents=True, exist_ok=True)
+            init_result = await duplicacy_service.init(
+                str(probe_dir),
+                WASABI_PROBE_SNAPSHOT_ID,
+                storage_url,
+                password=password,
+                encrypt=(True if password else False),
+                extra_env=extra_env,
+            )
+            if init_result.get("code") != 0:
+                shutil.rmtree(probe_dir, ignore_errors=True)
+                _raise_duplicacy_access_error(
+                    init_result.get("stdout") or init_result.get("stderr") or "No se pudo acceder al storage de Duplicacy"
                 )
-            if "password is not correct" in detail.lower() or "invalid password" in detail.lower():
-                raise HTTPException(status_code=400, detail="La contraseña de Duplicacy no es correcta.")
-            raise HTTPException(status_code=400, detail=detail)
 
         list_result = await duplicacy_service.list_snapshots(
-            tmp_dir,
+            str(probe_dir),
             password=password,
             storage_name="default",
             extra_env=extra_env,
             all_ids=True,
         )
         if list_result.get("code") != 0:
+            # Si el storage cambió (o la contraseña no vale) el próximo intento vuelve a hacer init desde cero
+            shutil.rmtree(probe_dir, ignore_errors=True)
+            _raise_duplicacy_access_error(list_result.get("stdout") or list_result.get("stderr") or "No se pudieron listar snapshots")
+
+    snapshots = list_result.get("snapshots") or []
+    grouped: Dict[str, Dict[str, Any]] = {}
+    # Una pasada: el dict de cada id se crea solo la primera vez y solo las revisiones enteras cuentan como última.
+    for s in snapshots:
+        sid = str(s.get("id") or "").strip()
+        if not sid:
+            continue
+        rev = s.get("revision")
+        if not isinstance(rev, int):
+            rev = None
+        item = grouped.get(sid)
+        if item is None:
+            grouped[sid] = {
+                "snapshotId": sid,
+                "revisions": 1,
+                "latestRevision": rev,
+                "latestCreatedAt": s.get("createdAt") if rev is not None else None,
+            }
+            continue
+        item["revisions"] += 1
+        if rev is not None and (item["latestRevision"] is None or rev > item["latestRevision"]):
+            item["latestRevision"] = rev
+            item["latestCreatedAt"] = s.get("createdAt")
 
+    snapshot_ids = sorted(grouped.keys())
+    payload = {
+        "ok": True,
+        "storageUrl": storage_url,
+        "snapshotIds": snapshot_ids,
+        "snapshots": [grouped[k] for k in snapshot_ids],
+    }
+    # TTL corto y reemplazo condicional: una detección concurrente con menos Snapshot IDs
+    # (listado parcial) no pisa a una más completa mientras esta siga vigente.
+    _remote_cache_set(
+        cache_key,
+        payload,
+        ttl_seconds=WASABI_SNAPSHOTS_CACHE_TTL_SECONDS,
+        replace_if=lambda new, old: len(new.get("snapshots") or []) >= len(old.get("snapshots") or []),
+    )
+    return payload
 
-            from fastapi import HTTPException
-            detail = (list_result.get("stdout") or list_result.get("stderr") or "No se pudieron listar snapshots")
-            raise HTTPException(status_code=400, detail=detail)
 
-        snapshots = list_result.get("snapshots") or []
-        grouped = {}
-        for s in snapshots:
-            sid = str(s.get("id") or "").strip()
-            if not sid:
-                continue
-            item = grouped.setdefault(sid, {"snapshotId": sid, "revisions": 0, "latestRevision": None, "latestCreatedAt": None})
-            item["revisions"] += 1
-            rev = s.get("revision")
-            if item["latestRevision"] is None or (isinstance(rev, int) and rev > item["latestRevision"]):
-                item["latestRevision"] = rev
-                item["latestCreatedAt"] = s.get("createdAt")
-
-        snapshot_ids = sorted(grouped.keys())
-        payload = {
-            "ok": True,
-            "storageUrl": storage_url,
-            "snapshotIds": snapshot_ids,
-            "snapshots": [grouped[k] for k in snapshot_ids],
-        }
-        _remote_cache_set(cache_key, payload)
-        return payload
+async def do_detect_wasabi_snapshots(req) -> Dict[str, Any]:
+    """Snapshot IDs de un storage Wasabi: caché con TTL corto y un único probe por storage+contraseña en curso."""
+    params = _wasabi_detect_params(req)
+    cached = _remote_cache_get(params["cache_key"])
+    if cached is not None:
+        return cached
+    return await single_flight(params["cache_key"], lambda: _probe_wasabi_snapshots(**params))
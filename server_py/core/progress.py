@@ -0,0 +1,175 @@
+import asyncio
+from collections import deque
+from itertools import islice
+from typing import Any, AsyncIterator, Dict, Iterator, List, Tuple
+
+import orjson
+
+# Líneas de salida que se retienen por operación en curso (backup/restore).
+OUTPUT_LINES_MAXLEN = 2000
+
+# Tramas SSE estáticas: se serializan una sola vez.
+SSE_RUNNING = b'data: {"running": true}\n\n'
+SSE_DONE = b'data: {"done": true}\n\n'
+# Sin novedades, los streams SSE emiten un heartbeat cada N segundos.
+SSE_KEEPALIVE_SECONDS = 15.0
+# Ventana de agrupación: tras un aviso se espera este tiempo para enviar varias líneas en una trama.
+SSE_COALESCE_SECONDS = 0.05
+# Tamaño aproximado máximo (bytes UTF-8) del campo output de una trama SSE; si se supera se parte.
+SSE_MAX_FRAME_BYTES = 64 * 1024
+
+
+def sse_frame(payload: Any) -> bytes:
+    """Trama SSE `data: <json>` serializada con orjson directamente a bytes."""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+
+_SSE_OUTPUT_PREFIX = b'data: {"running":true,"output":'
+_SSE_OUTPUT_SUFFIX = b"}\n\n"
+
+
+def split_output_chunks(lines: List[str], max_chars: int = SSE_MAX_FRAME_BYTES) -> Iterator[str]:
+    """Agrupa líneas en bloques unidos por "\\n" de como mucho ~max_chars (una línea mayor va sola).
+
+    Se mide en caracteres para no codificar cada línea dos veces; con UTF-8 es una cota aproximada.
+    """
+    start = 0
+    size = 0
+    for index, line in enumerate(lines):
+        line_size = len(line) + 1
+        if index > start and size + line_size > max_chars:
+            yield "\n".join(lines[start:index])
+            start = index
+            size = 0
+        size += line_size
+    if start < len(lines):
+        yield "\n".join(lines[start:] if start else lines)
+
+
+def sse_output_frames(lines: List[str]) -> Iterator[bytes]:
+    """Tramas SSE `{"running": true, "output": "..."}` ya codificadas, sin dict intermedio.
+
+    `output` sigue siendo un string unido por saltos de línea (es lo que consume web/js).
+    """
+    for chunk in split_output_chunks(lines):
+        yield _SSE_OUTPUT_PREFIX + orjson.dumps(chunk) + _SSE_OUTPUT_SUFFIX
+
+
+class OutputLines(deque):
+    """deque acotada de líneas con contador total monotónico usado como cursor por los lectores SSE."""
+
+    def __init__(self, maxlen: int = OUTPUT_LINES_MAXLEN):
+        super().__init__(maxlen=maxlen)
+        self.total = 0
+
+    def append(self, line: str) -> None:
+        super().append(line)
+        self.total += 1
+
+    def since(self, cursor: int) -> Tuple[List[str], int]:
+        """Líneas añadidas desde `cursor` (las descartadas por maxlen se pierden) y el nuevo cursor."""
+        pending = self.total - cursor
+        if pending <= 0:
+            return [], self.total
+        size = len(self)
+        return list(islice(self, max(0, size - pending), size)), self.total
+
+
+class ProgressSignal:
+    """Aviso broadcast para lectores SSE: notify() despierta a todos los que esperan en wait().
+
+    Debe usarse desde el hilo del event loop (on_progress de DuplicacyService.exec ya corre ahí).
+    """
+
+    __slots__ = ("_event", "_waiters")
+
+    def __init__(self):
+        self._event = asyncio.Event()
+        self._waiters = 0
+
+    def notify(self) -> None:
+        # Solo se rota el Event si hay alguien esperando: sin lectores, notify() es casi gratis.
+        if self._waiters:
+            event, self._event = self._event, asyncio.Event()
+            event.set()
+
+    async def wait(self, timeout: float) -> bool:
+        """Espera al próximo notify(). Retorna False si vence el timeout."""
+        event = self._event
+        self._waiters += 1
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._waiters -= 1
+
+
+class ProgressFeed:
+    """Salida en vivo de una operación, separada de sus metadatos: líneas, última línea y aviso SSE."""
+
+    __slots__ = ("lines", "signal", "last")
+
+    def __init__(self, maxlen: int = OUTPUT_LINES_MAXLEN, initial: str = ""):
+        self.lines = OutputLines(maxlen)
+        self.signal = ProgressSignal()
+        self.last = initial
+
+    def push(self, line: str) -> None:
+        self.last = line
+        self.lines.append(line)
+        self.signal.notify()
+
+
+def restore_done_payload(completed: Dict[str, Any]) -> Dict[str, Any]:
+    """Trama final de un restore (lo que consume web/js: success, canceled, finalOutput, restorePath)."""
+    return {
+        "done": True,
+        "success": completed.get("code", -1) == 0 and not completed.get("canceled"),
+        "canceled": bool(completed.get("canceled")),
+        "code": completed.get("code", -1),
+        "finalOutput": completed.get("stdout", "") or completed.get("stderr", ""),
+        "restorePath": completed.get("restorePath"),
+    }
+
+
+async def restore_progress_events(states: Dict[str, Any], key: str) -> AsyncIterator[bytes]:
+    """Stream SSE de un restore guardado en states[key] (objeto con `progress`, `running` y `completed`).
+
+    Antes de la trama final se envían las líneas que quedaran pendientes, y solo entonces se retira el estado.
+    """
+    sent_lines = 0
+    heartbeat_due = True
+    while True:
+        state = states.get(key)
+        if state is None:
+            yield SSE_DONE
+            await asyncio.sleep(1)
+            return
+
+        progress = state.progress
+        # Solo las líneas nuevas desde el cursor: O(nuevas), no se recorre la cola entera.
+        new_lines, sent_lines = progress.lines.since(sent_lines)
+        if new_lines:
+            heartbeat_due = False
+            for frame in sse_output_frames(new_lines):
+                yield frame
+            continue
+
+        if state.running:
+            if heartbeat_due:
+                heartbeat_due = False
+                yield SSE_RUNNING
+                continue
+            # Sin líneas pendientes: esperar salida nueva o fin; heartbeat si no llega nada.
+            heartbeat_due = not await progress.signal.wait(SSE_KEEPALIVE_SECONDS)
+            if not heartbeat_due:
+                # Ventana breve para agrupar la ráfaga de líneas en una sola trama.
+                await asyncio.sleep(SSE_COALESCE_SECONDS)
+            continue
+
+        if states.get(key) is state:
+            states.pop(key, None)
+        yield sse_frame(restore_done_payload(state.completed))
+        return
@@ -1,6 +1,10 @@
-import json
+import asyncio
+import hashlib
 import time
-from typing import Any, Dict, Optional
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+import orjson
 
 from server_py.utils.logger import get_logger
 from server_py.utils.paths import REMOTE_CACHE_DIR, REMOTE_CACHE_PROBES_DIR
@@ -8,6 +12,8 @@ from server_py.utils.paths import REMOTE_CACHE_DIR, REMOTE_CACHE_PROBES_DIR
 logger = get_logger("RemoteCache")
 
 REMOTE_LIST_CACHE_TTL_SECONDS = 3600
+# Las escrituras de lookup_cache.json se agrupan y se hacen fuera del event loop.
+REMOTE_CACHE_SAVE_DELAY_SECONDS = 1.0
 
 CACHE_DIR = REMOTE_CACHE_DIR
 CACHE_DIR.mkdir(parents=True, exist_ok=True)
@@ -15,45 +21,229 @@ PROBES_DIR = REMOTE_CACHE_PROBES_DIR
 PROBES_DIR.mkdir(parents=True, exist_ok=True)
 LOOKUP_CACHE_FILE = CACHE_DIR / "lookup_cache.json"
 
+# Familias de claves cuyo segundo componente es el repoId / el id de storage.
+_REPO_SCOPED_PREFIXES = ("repo-snapshots", "repo-files")
+_STORAGE_SCOPED_PREFIXES = ("storage-revisions", "storage-files")
+
+
+class RemoteListCache(dict):
+    """Dict persistible con índices secundarios (repoId / storageId) -> claves para invalidar sin recorrer todo."""
+
+    def __init__(self, data: Optional[Dict[str, Any]] = None):
+        super().__init__()
+        self._by_scope: Dict[Tuple[str, str], Set[str]] = {}
+        for key, value in (data or {}).items():
+            self[key] = value
+
+    @staticmethod
+    def _scope_of(key: str) -> Optional[Tuple[str, str]]:
+        parts = str(key).split("||", 2)
+        if len(parts) >= 2:
+            if parts[0] in _REPO_SCOPED_PREFIXES:
+                return ("repo", parts[1])
+            if parts[0] in _STORAGE_SCOPED_PREFIXES:
+                return ("storage", parts[1])
+        return None
+
+    def _unindex(self, key: str) -> None:
+        scope = self._scope_of(key)
+        if scope is None:
+            return
+        keys = self._by_scope.get(scope)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                self._by_scope.pop(scope, None)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        super().__setitem__(key, value)
+        scope = self._scope_of(key)
+        if scope is not None:
+            self._by_scope.setdefault(scope, set()).add(key)
+
+    def __delitem__(self, key: str) -> None:
+        super().__delitem__(key)
+        self._unindex(key)
+
+    def pop(self, key: str, *default: Any) -> Any:
+        self._unindex(key)
+        return super().pop(key, *default)
+
+    def _invalidate_scope(self, scope: Tuple[str, str]) -> int:
+        keys = self._by_scope.pop(scope, None) or ()
+        for key in keys:
+            super().pop(key, None)
+        return len(keys)
+
+    def invalidate_repo(self, repo_id: str) -> int:
+        """Elimina todas las entradas repo-snapshots/repo-files de un repo. Retorna cuántas."""
+        return self._invalidate_scope(("repo", repo_id))
+
+    def invalidate_storage(self, storage_id: str) -> int:
+        """Elimina todas las entradas storage-revisions/storage-files de un storage. Retorna cuántas."""
+        return self._invalidate_scope(("storage", storage_id))
+
 
 def _load_remote_cache() -> Dict[str, Dict[str, Any]]:
     if LOOKUP_CACHE_FILE.exists():
         try:
-            with open(LOOKUP_CACHE_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
+            return orjson.loads(LOOKUP_CACHE_FILE.read_bytes())
         except Exception:
             pass
     return {}
 
 
-remote_storage_list_cache: Dict[str, Dict[str, Any]] = _load_remote_cache()
+remote_storage_list_cache: RemoteListCache = RemoteListCache(_load_remote_cache())
+# JSON ya serializado por clave (solo en memoria), ligado al ts de la entrada para no servir datos viejos.
+_remote_cache_encoded: Dict[str, Tuple[float, bytes]] = {}
+
+
+# Listados remotos en curso por clave de caché (single-flight).
+_inflight_fetches: Dict[str, "asyncio.Task[Any]"] = {}
+
+
+async def single_flight(key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+    """Ejecuta fetch() una sola vez por clave: las peticiones concurrentes esperan el mismo resultado.
+
+    La tarea no depende de ningún llamador, así que si uno se desconecta los demás siguen esperando.
+    """
+    task = _inflight_fetches.get(key)
+    if task is None:
+        task = asyncio.ensure_future(fetch())
+        _inflight_fetches[key] = task
+
+        def _done(t: "asyncio.Task[Any]") -> None:
+            if _inflight_fetches.get(key) is t:
+                _inflight_fetches.pop(key, None)
+            if not t.cancelled():
+                t.exception()  # evita el aviso "exception was never retrieved" si nadie esperaba
+
+        task.add_done_callback(_done)
+    return await asyncio.shield(task)
 
 
 def _remote_cache_key(*parts: Any) -> str:
     return "||".join(str(p) for p in parts)
 
 
+@lru_cache(maxsize=256)
+def _pw_fingerprint(password: str) -> str:
+    """Discriminador de contraseña para claves de caché (blake2b de 8 bytes en hex, '' si no hay contraseña).
+
+    Solo separa entradas de caché: no necesita la salida larga de sha256.
+    """
+    return hashlib.blake2b(password.encode("utf-8"), digest_size=8).hexdigest() if password else ""
+
+
+def _entry_ttl(item: Dict[str, Any]) -> float:
+    return float(item.get("ttl") or REMOTE_LIST_CACHE_TTL_SECONDS)
+
+
 def _remote_cache_get(key: str) -> Optional[Any]:
     item = remote_storage_list_cache.get(key)
     if not item:
         return None
     ts = float(item.get("ts") or 0)
-    if (time.time() - ts) > REMOTE_LIST_CACHE_TTL_SECONDS:
+    if (time.time() - ts) > _entry_ttl(item):
         remote_storage_list_cache.pop(key, None)
         return None
     return item.get("value")
 
 
-def _save_remote_cache() -> None:
+def _encode_json(value: Any) -> bytes:
+    # orjson serializa directo a bytes UTF-8 compactos (mismo formato que el JSONResponse de FastAPI).
+    return orjson.dumps(value)
+
+
+def _remote_cache_get_bytes(key: str) -> Optional[bytes]:
+    """Como _remote_cache_get pero devuelve el JSON ya codificado (se serializa una vez por entrada)."""
+    value = _remote_cache_get(key)
+    if value is None:
+        _remote_cache_encoded.pop(key, None)
+        return None
+    ts = float((remote_storage_list_cache.get(key) or {}).get("ts") or 0)
+    encoded = _remote_cache_encoded.get(key)
+    if encoded is not None and encoded[0] == ts:
+        return encoded[1]
+    body = _encode_json(value)
+    _remote_cache_encoded[key] = (ts, body)
+    return body
+
+
+def _write_remote_cache_file(data: bytes) -> None:
     try:
         tmp_file = LOOKUP_CACHE_FILE.with_suffix(".tmp")
-        with open(tmp_file, "w", encoding="utf-8") as f:
-            json.dump(remote_storage_list_cache, f)
+        tmp_file.write_bytes(data)
         tmp_file.replace(LOOKUP_CACHE_FILE)
     except Exception as e:
         logger.error(f"Error saving remote cache: {e}")
 
 
-def _remote_cache_set(key: str, value: Any) -> None:
-    remote_storage_list_cache[key] = {"ts": time.time(), "value": value}
-    _save_remote_cache()
+def _prune_expired_remote_cache() -> None:
+    now = time.time()
+    expired = [
+        k for k, item in remote_storage_list_cache.items()
+        if now - float((item or {}).get("ts") or 0) > _entry_ttl(item or {})
+    ]
+    for key in expired:
+        remote_storage_list_cache.pop(key, None)
+        _remote_cache_encoded.pop(key, None)
+
+
+def _save_remote_cache() -> None:
+    _prune_expired_remote_cache()
+    _write_remote_cache_file(orjson.dumps(remote_storage_list_cache))
+
+
+_save_task: Optional[asyncio.Task] = None
+# Hay cambios sin guardar; se vuelve a comprobar tras cada escritura porque mientras la tarea
+# de guardado sigue viva no se programa otra.
+_save_dirty = False
+
+
+async def _save_remote_cache_later() -> None:
+    global _save_dirty
+    while True:
+        await asyncio.sleep(REMOTE_CACHE_SAVE_DELAY_SECONDS)
+        _save_dirty = False
+        # Se serializa en el loop (nadie muta el dict a la vez) y solo la escritura va a un hilo.
+        _prune_expired_remote_cache()
+        data = orjson.dumps(remote_storage_list_cache)
+        await asyncio.to_thread(_write_remote_cache_file, data)
+        if not _save_dirty:
+            return
+
+
+def _schedule_remote_cache_save() -> None:
+    global _save_task, _save_dirty
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _save_remote_cache()
+        return
+    _save_dirty = True
+    if _save_task is None or _save_task.done():
+        _save_task = loop.create_task(_save_remote_cache_later())
+
+
+def _remote_cache_set(
+    key: str,
+    value: Any,
+    ttl_seconds: Optional[float] = None,
+    replace_if: Optional[Callable[[Any, Any], bool]] = None,
+) -> bool:
+    """Guarda value en la caché remota. Retorna False si se conservó la entrada vigente.
+
+    ttl_seconds: caducidad propia de la entrada (por defecto REMOTE_LIST_CACHE_TTL_SECONDS).
+    replace_if(new, old): si hay una entrada sin caducar, solo se reemplaza cuando devuelve True.
+    """
+    if replace_if is not None:
+        old = _remote_cache_get(key)
+        if old is not None and not replace_if(value, old):
+            return False
+    item: Dict[str, Any] = {"ts": time.time(), "value": value}
+    if ttl_seconds is not None:
+        item["ttl"] = float(ttl_seconds)
+    remote_storage_list_cache[key] = item
+    _schedule_remote_cache_save()
+    return True
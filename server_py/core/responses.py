@@ -0,0 +1,14 @@
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+
+
+class OrjsonResponse(JSONResponse):
+    """JSONResponse serializada con orjson (más rápido y directo a bytes).
+
+    Equivale al ORJSONResponse de FastAPI, que está deprecado en las versiones recientes.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
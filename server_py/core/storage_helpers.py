@@ -1,6 +1,6 @@
 import os
 import re
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
 from fastapi import HTTPException
 from server_py.utils.logger import get_logger
 from server_py.utils import config_store
@@ -9,6 +9,8 @@ from server_py.models.schemas import RepoCreate, RepoUpdate
 
 logger = get_logger("StorageHelpers")
 INTERNAL_STORAGE_SECRET_KEYS = {"_secrets", "accessId", "accessKey", "duplicacyPassword"}
+# storageRefId -> versiones de config con las que se comprobó que el storage no guarda contraseña.
+_storage_without_password: Dict[str, Tuple[int, int]] = {}
 
 
 def normalize_storage_comparable_url(value: Any) -> str:
@@ -34,6 +36,41 @@ def repo_matches_storage_record(repo: Dict[str, Any], storage: Dict[str, Any]) -
     # Fallback legacy: solo si falta URL en el repo.
     return bool(repo.get("storageRefId") and storage.get("id") and repo.get("storageRefId") == storage.get("id"))
 
+
+# (versión de storages, URL comparable -> storages, id -> storage, id() -> posición): índice para casar
+# repos sin recorrer la lista.
+_storage_match_index: Optional[Tuple[int, Dict[str, List[Dict[str, Any]]], Dict[str, Dict[str, Any]], Dict[int, int]]] = None
+
+
+def matching_storage_records(repo: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Storages configurados que casan con el repo según repo_matches_storage_record, vía índice por URL e id.
+
+    Se devuelven en el orden de la config y son los registros del índice: solo lectura.
+    """
+    global _storage_match_index
+    version = config_store.storages.version
+    cached = _storage_match_index
+    if cached is None or cached[0] != version:
+        storages, by_id = config_store.storages.read_as_map()
+        by_url: Dict[str, List[Dict[str, Any]]] = {}
+        positions = {id(storage): pos for pos, storage in enumerate(storages)}
+        for storage in storages:
+            url = normalize_storage_comparable_url(storage.get("url") or storage.get("localPath") or "")
+            if url:
+                by_url.setdefault(url, []).append(storage)
+        cached = _storage_match_index = (version, by_url, by_id, positions)
+    _, by_url, by_id, positions = cached
+
+    primary = get_primary_storage(repo) or {}
+    repo_url = normalize_storage_comparable_url(primary.get("url") or repo.get("storageUrl") or "")
+    candidates = list(by_url.get(repo_url, ())) if repo_url else []
+    # Fallback legacy por storageRefId (storages sin URL o repos sin URL).
+    ref = by_id.get(repo.get("storageRefId")) if repo.get("storageRefId") else None
+    if ref is not None and all(ref is not c for c in candidates):
+        candidates.append(ref)
+        candidates.sort(key=lambda storage: positions[id(storage)])
+    return [storage for storage in candidates if repo_matches_storage_record(repo, storage)]
+
 def sanitize_storage(storage: Dict[str, Any]) -> Dict[str, Any]:
     sanitized = dict(storage)
     for key in INTERNAL_STORAGE_SECRET_KEYS:
@@ -45,9 +82,9 @@ def sanitize_storage(storage: Dict[str, Any]) -> Dict[str, Any]:
     return sanitized
 
 def get_storage_by_id(storage_id: str) -> Optional[Dict[str, Any]]:
-    # Buscamos en todos los storages (gestionados + derivados) para evitar errores 404 en backups legacy
-    storages = list_all_storages_for_ui()
-    return next((s for s in storages if s.get("id") == storage_id), None)
+    # list_all_storages_for_ui solo expone storages configurados: basta el índice por id (solo lectura).
+    _, storages_by_id = config_store.storages.read_as_map()
+    return storages_by_id.get(storage_id)
 
 def get_repo_storage(repo: Dict[str, Any], storage_name: str) -> Optional[Dict[str, Any]]:
     for storage in repo.get("storages", []):
@@ -118,13 +155,23 @@ def get_repo_duplicacy_password(repo: Dict[str, Any], storage_name: Optional[str
     # 3. Buscar en el storage vinculado centralmente
     ref_id = repo.get("storageRefId")
     if ref_id:
-        storage = get_storage_by_id(ref_id)
-        if storage:
-            storage_secrets = storage.get("_secrets") or {}
-            return reveal_secret(storage_secrets.get("duplicacyPassword"))
+        return _get_storage_duplicacy_password(ref_id)
     
     return None
 
+def _get_storage_duplicacy_password(storage_id: str) -> Optional[str]:
+    # Negativo cacheado: evita recorrer todos los storages mientras la config no cambie.
+    versions = (config_store.storages.version, config_store.repositories.version)
+    if _storage_without_password.get(storage_id) == versions:
+        return None
+    storage = get_storage_by_id(storage_id)
+    password = reveal_secret(((storage or {}).get("_secrets") or {}).get("duplicacyPassword"))
+    if password:
+        _storage_without_password.pop(storage_id, None)
+    else:
+        _storage_without_password[storage_id] = versions
+    return password
+
 def build_wasabi_env(access_id: str, access_key: str, storage_name: str = "default") -> Dict[str, str]:
     access_id = (access_id or "").strip()
     access_key = (access_key or "").strip()
@@ -148,10 +195,16 @@ def build_wasabi_env(access_id: str, access_key: str, storage_name: str = "defau
     }
 
 def get_storage_record_env(storage: Dict[str, Any], storage_name: str = "default") -> Dict[str, str]:
+    return get_storage_record_envs(storage, storage_name)[storage_name]
+
+def get_storage_record_envs(storage: Dict[str, Any], *storage_names: str) -> Dict[str, Dict[str, str]]:
+    """Env por alias para un storage, revelando los secretos una sola vez."""
     if (storage.get("type") or "").lower() != "wasabi":
-        return {}
+        return {name: {} for name in storage_names}
     secrets = storage.get("_secrets") or {}
-    return build_wasabi_env(reveal_secret(secrets.get("accessId")) or "", reveal_secret(secrets.get("accessKey")) or "", storage_name)
+    access_id = reveal_secret(secrets.get("accessId")) or ""
+    access_key = reveal_secret(secrets.get("accessKey")) or ""
+    return {name: build_wasabi_env(access_id, access_key, name) for name in storage_names}
 
 def build_wasabi_storage_url(region: str, endpoint: str, bucket: str, directory: Optional[str]) -> str:
     clean_endpoint = endpoint.strip().replace("https://", "").replace("http://", "").strip("/")
@@ -339,8 +392,9 @@ def build_destination_from_storage_ref(storage: Dict[str, Any]) -> Dict[str, Any
     }
 
 def list_all_storages_for_ui() -> List[Dict[str, Any]]:
-    explicit = config_store.storages.read()
-    repos_data = config_store.repositories.read()
+    # Listas cacheadas por versión (solo lectura): no se parsea el JSON de config en cada listado.
+    explicit, _ = config_store.storages.read_as_map()
+    repos_data, _ = config_store.repositories.read_as_map()
 
     by_id: Dict[str, Dict[str, Any]] = {}
     
@@ -349,7 +403,8 @@ def list_all_storages_for_ui() -> List[Dict[str, Any]]:
         item = dict(s)
         item.setdefault("source", "managed")
         item.setdefault("linkedBackups", 0)
-        item.setdefault("fromRepoIds", [])
+        # Lista propia: se amplía abajo y el registro de origen es compartido.
+        item["fromRepoIds"] = list(item.get("fromRepoIds") or [])
         storage_id = item.get("id")
         if storage_id:
             by_id[storage_id] = item
@@ -359,8 +414,9 @@ def list_all_storages_for_ui() -> List[Dict[str, Any]]:
         repo_id = repo.get("id")
         if not repo_id:
             continue
-        for matched in by_id.values():
-            if repo_matches_storage_record(repo, matched):
+        for storage in matching_storage_records(repo):
+            matched = by_id.get(storage.get("id"))
+            if matched is not None:
                 if repo_id not in matched["fromRepoIds"]:
                     matched["fromRepoIds"].append(repo_id)
                     matched["linkedBackups"] += 1
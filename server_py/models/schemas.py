@@ -1,5 +1,5 @@
 from typing import List, Optional, Dict, Any
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
 
 class RepoCreate(BaseModel):
     name: str
@@ -91,7 +91,19 @@ class RepoUpdate(BaseModel):
 class RepoNotificationTestRequest(BaseModel):
     notifications: Optional[Dict[str, Any]] = None
 
-class StorageCreate(BaseModel):
+class _StrippedStorageFields(BaseModel):
+    """Recorta espacios de los campos de texto de storage al parsear (las contraseñas se dejan tal cual)."""
+
+    @field_validator(
+        "name", "type", "localPath", "endpoint", "region", "bucket", "directory", "accessId", "accessKey",
+        mode="before",
+        check_fields=False,
+    )
+    @classmethod
+    def _strip_text(cls, value: Any) -> Any:
+        return value.strip() if isinstance(value, str) else value
+
+class StorageCreate(_StrippedStorageFields):
     name: str
     type: str  # local | wasabi
     localPath: Optional[str] = None
@@ -103,7 +115,7 @@ class StorageCreate(BaseModel):
     accessKey: Optional[str] = None
     duplicacyPassword: Optional[str] = None
 
-class StorageUpdate(BaseModel):
+class StorageUpdate(_StrippedStorageFields):
     name: Optional[str] = None
     localPath: Optional[str] = None
     endpoint: Optional[str] = None
@@ -16,9 +16,9 @@ from server_py.services.duplicacy import service as duplicacy_service
 from server_py.services.notifications import notify_backup_success, test_backup_notifications
 from server_py.utils.secret_crypto import protect_secrets_deep
 from server_py.core.helpers import (
-    sanitize_repo, get_storage_by_id, build_destination_from_storage_ref, 
+    sanitize_repo, sanitize_repos_cached, get_storage_by_id, build_destination_from_storage_ref, 
     resolve_repo_destination, get_storage_env, get_primary_storage, 
-    describe_storage, summarize_path_selection, get_storage_record_env, 
+    describe_storage, summarize_path_selection, get_storage_record_env, get_storage_record_envs, 
     build_backup_change_summary, FIXED_DUPLICACY_THREADS,
     active_backups, completed_backups, active_backup_processes, 
     scheduler_task, scheduler_running, remote_storage_list_cache,
@@ -26,12 +26,18 @@ from server_py.core.helpers import (
     normalize_repo_notifications_config,
     get_repo_duplicacy_password,
     build_destination_from_update, _repo_snapshot_revisions,
-    sync_repo_filters_file,
+    sync_repo_filters_file, OutputLines, SSE_RUNNING, SSE_DONE,
     logger
 )
 
 router = APIRouter(tags=["backups"])
 
+# La salida completa ya llega línea a línea vía on_progress; del resultado final solo
+# se conserva la cola (lastBackupOutput, finalOutput, notificación).
+BACKUP_STDOUT_TAIL_LINES = 200
+# Límite para el resumen de cambios post-backup (corre en paralelo con la persistencia).
+BACKUP_SUMMARY_TIMEOUT_SECONDS = 600
+
 # --- Repositories / Backup Jobs ---
 
 def _validate_repo_notifications_on_save(notifications: Dict[str, Any]):
@@ -66,8 +72,8 @@ def _validate_repo_notifications_on_save(notifications: Dict[str, Any]):
 
 @router.get("/api/repos")
 async def get_repos():
-    repos = repositories_config.read()
-    return {"ok": True, "repos": [sanitize_repo(r) for r in repos]}
+    repos = await asyncio.to_thread(repositories_config.read)
+    return {"ok": True, "repos": sanitize_repos_cached(repos)}
 
 
 @router.post("/api/repos/validate")
@@ -121,8 +127,8 @@ async def validate_repo(repo: RepoCreate):
 
 @router.get("/api/repos/{repo_id}")
 async def get_repo(repo_id: str):
-    repos_data = repositories_config.read()
-    repo = next((r for r in repos_data if r["id"] == repo_id), None)
+    _, repos_by_id = await asyncio.to_thread(repositories_config.read_as_map)
+    repo = repos_by_id.get(repo_id)
     if not repo:
         raise HTTPException(status_code=404, detail="Repository not found")
     return {"ok": True, "repo": sanitize_repo(repo)}
@@ -153,7 +159,9 @@ async def create_repo(repo: RepoCreate):
     encrypt_enabled = repo.encrypt if repo.encrypt is not None else (True if init_password else False)
 
     # Cargar variables de entorno del storage, asegurando que cubran el alias dinámico
+    # (add) y "default" (init) con una sola resolución de secretos.
     extra_env = dict(destination.get("extraEnv") or {})
+    init_alias_env: Dict[str, str] = {}
     if linked_storage or (repo.destinationType == "wasabi"):
         src = linked_storage or {
             "type": "wasabi",
@@ -162,8 +170,10 @@ async def create_repo(repo: RepoCreate):
                 "accessKey": repo.wasabiAccessKey
             }
         }
+        record_envs = get_storage_record_envs(src, duplicacy_storage_name, "default")
         # Inyectar credenciales específicamente para el alias que vamos a usar en Duplicacy
-        extra_env.update(get_storage_record_env(src, duplicacy_storage_name))
+        extra_env.update(record_envs[duplicacy_storage_name])
+        init_alias_env = record_envs["default"]
 
     if is_already_init:
         logger.info(f"[RepoInit] Carpeta ya inicializada. Usando 'add' para snapshotId={repo.snapshotId} en {repo_path}")
@@ -179,8 +189,7 @@ async def create_repo(repo: RepoCreate):
     else:
         logger.info(f"[RepoInit] Iniciando init en {repo_path} con snapshotId={repo.snapshotId}")
         # Para init, duplicacy usa "default" como nombre interno
-        init_env = dict(extra_env)
-        init_env.update(get_storage_record_env(src, "default"))
+        init_env = {**extra_env, **init_alias_env}
         result = await duplicacy_service.init(
             str(repo_path),
             repo.snapshotId,
@@ -216,7 +225,6 @@ async def create_repo(repo: RepoCreate):
             remapped_secrets[duplicacy_storage_name] = val
         secrets = remapped_secrets
 
-    repos_data = repositories_config.read()
     normalized_notifications = normalize_repo_notifications_config(repo.notifications)
     _validate_repo_notifications_on_save(normalized_notifications)
     new_repo = {
@@ -247,8 +255,12 @@ async def create_repo(repo: RepoCreate):
     if secrets:
         secrets = protect_secrets_deep(secrets)
         new_repo["_secrets"] = secrets
-    repos_data.append(new_repo)
-    repositories_config.write(repos_data)
+
+    def add_repo(all_repos):
+        all_repos.append(new_repo)
+        return all_repos
+
+    await asyncio.to_thread(repositories_config.atomic_update, add_repo)
     
     return {"ok": True, "repo": sanitize_repo(new_repo)}
 
@@ -272,7 +284,7 @@ async def update_repo(repo_id: str, req: RepoUpdate):
                 r["notifications"] = normalized_notifications
         return all_repos
 
-    repos_data = repositories_config.atomic_update(apply_update)
+    repos_data = await asyncio.to_thread(repositories_config.atomic_update, apply_update)
     repo = next((r for r in repos_data if r["id"] == repo_id), None)
     if not repo:
         raise HTTPException(status_code=404, detail="Repository not found")
@@ -282,8 +294,8 @@ async def update_repo(repo_id: str, req: RepoUpdate):
 
 @router.post("/api/repos/{repo_id}/test-notifications")
 async def test_repo_notifications(repo_id: str, req: RepoNotificationTestRequest):
-    repos_data = repositories_config.read()
-    repo = next((r for r in repos_data if r["id"] == repo_id), None)
+    _, repos_by_id = await asyncio.to_thread(repositories_config.read_as_map)
+    repo = repos_by_id.get(repo_id)
     if not repo:
         raise HTTPException(status_code=404, detail="Backup no encontrado")
 
@@ -322,21 +334,29 @@ async def delete_repo(repo_id: str):
             detail="No se puede eliminar el repositorio mientras hay un backup en ejecución. Cancélalo primero."
         )
     
-    repos_data = repositories_config.read()
-    repo = next((r for r in repos_data if r["id"] == repo_id), None)
-    if not repo:
+    _, repos_by_id = await asyncio.to_thread(repositories_config.read_as_map)
+    if repo_id not in repos_by_id:
         raise HTTPException(status_code=404, detail="Repository not found")
-    
-    repos_data = [r for r in repos_data if r["id"] != repo_id]
-    repositories_config.write(repos_data)
+
+    # Se filtra sobre la lista releída dentro del lock para no pisar cambios del scheduler o de otros handlers.
+    removed: List[Dict[str, Any]] = []
+
+    def remove_repo(all_repos):
+        removed.extend(r for r in all_repos if r.get("id") == repo_id)
+        return [r for r in all_repos if r.get("id") != repo_id]
+
+    await asyncio.to_thread(repositories_config.atomic_update, remove_repo)
+    if not removed:
+        raise HTTPException(status_code=404, detail="Repository not found")
+    repo = removed[0]
     return {"ok": True, "removed": sanitize_repo(repo)}
 
 # --- Backup ---
 
 @router.post("/api/backup/start")
 async def start_backup(req: BackupStart):
-    repos_data = repositories_config.read()
-    repo = next((r for r in repos_data if r["id"] == req.repoId), None)
+    _, repos_by_id = await asyncio.to_thread(repositories_config.read_as_map)
+    repo = repos_by_id.get(req.repoId)
     
     if not repo:
         raise HTTPException(status_code=404, detail="Repository not found")
@@ -359,7 +379,7 @@ async def start_backup(req: BackupStart):
         "status": "running",
         "startedAt": datetime.now().isoformat(),
         "lastOutput": "Iniciando...",
-        "outputLines": [],
+        "outputLines": OutputLines(),
         "cancelRequested": False,
         "trigger": trigger,
     }
@@ -379,18 +399,21 @@ async def start_backup(req: BackupStart):
         started_monotonic = time.monotonic()
         pre_latest_revision: Optional[int] = None
         primary_storage_name: Optional[str] = None
+        finished_at_iso: Optional[str] = None
+        summary_task: Optional[asyncio.Task] = None
+
+        backup_info = active_backups[req.repoId]
+        output_lines = backup_info["outputLines"]
 
         def on_progress(text):
-            if req.repoId in active_backups:
-                clean = (text or "").rstrip("\r\n")
-                if clean:
-                    active_backups[req.repoId]["lastOutput"] = clean
-                    active_backups[req.repoId].setdefault("outputLines", []).append(clean)
+            clean = text.rstrip("\r\n") if text else ""
+            if clean:
+                backup_info["lastOutput"] = clean
+                output_lines.append(clean)
 
         def on_process_start(proc):
             active_backup_processes[req.repoId] = proc
-            if req.repoId in active_backups:
-                active_backups[req.repoId]["pid"] = getattr(proc, "pid", None)
+            backup_info["pid"] = getattr(proc, "pid", None)
 
         result = {"code": -1, "stdout": "", "stderr": "Error no especificado"}
         try:
@@ -408,28 +431,36 @@ async def start_backup(req: BackupStart):
                 # Auto-recuperar password
                 primary_storage_name = repo.get("duplicacyStorageName") or primary.get("name")
                 effective_password = req.password or get_repo_duplicacy_password(repo, primary_storage_name)
+                primary_env = get_storage_env(repo, primary_storage_name)
 
-                try:
-                    pre_list = await duplicacy_service.list_snapshots(
-                        repo["path"],
-                        password=effective_password,
-                        storage_name=primary_storage_name,
-                        extra_env=get_storage_env(repo, primary_storage_name),
-                    )
-                    if pre_list.get("code") == 0:
-                        pre_revs = _repo_snapshot_revisions(pre_list.get("snapshots") or [], str(repo.get("snapshotId") or ""))
-                        pre_latest_revision = pre_revs[-1] if pre_revs else None
-                except Exception:
-                    logger.exception("[Backup] No se pudo obtener revision previa repo=%s", req.repoId)
+                async def fetch_pre_latest_revision() -> Optional[int]:
+                    try:
+                        pre_list = await duplicacy_service.list_snapshots(
+                            repo["path"],
+                            password=effective_password,
+                            storage_name=primary_storage_name,
+                            extra_env=primary_env,
+                        )
+                        if pre_list.get("code") == 0:
+                            pre_revs = _repo_snapshot_revisions(pre_list.get("snapshots") or [], str(repo.get("snapshotId") or ""))
+                            return pre_revs[-1] if pre_revs else None
+                    except Exception:
+                        logger.exception("[Backup] No se pudo obtener revision previa repo=%s", req.repoId)
+                    return None
+
+                # Revisión previa y fichero de filtros son independientes: en paralelo.
+                pre_outcome, filters_outcome = await asyncio.gather(
+                    fetch_pre_latest_revision(),
+                    asyncio.to_thread(sync_repo_filters_file, repo),
+                    return_exceptions=True,
+                )
+                pre_latest_revision = pre_outcome if isinstance(pre_outcome, int) else None
 
-                try:
-                    sync_repo_filters_file(repo)
-                except Exception as exc:
-                    result = {"code": -1, "stdout": "", "stderr": f"No se pudo preparar filtros del backup: {exc}"}
+                if isinstance(filters_outcome, BaseException):
+                    result = {"code": -1, "stdout": "", "stderr": f"No se pudo preparar filtros del backup: {filters_outcome}"}
                 else:
-                    if req.repoId in active_backups:
-                        prefix = "Backup programado" if trigger == "scheduler" else "Backup"
-                        active_backups[req.repoId]["lastOutput"] = f"{prefix} en {primary.get('label', primary['name'])}..."
+                    prefix = "Backup programado" if trigger == "scheduler" else "Backup"
+                    backup_info["lastOutput"] = f"{prefix} en {primary.get('label', primary['name'])}..."
 
                     result = await duplicacy_service.backup(
                         repo["path"],
@@ -438,15 +469,16 @@ async def start_backup(req: BackupStart):
                         on_progress=on_progress,
                         on_process_start=on_process_start,
                         storage_name=primary_storage_name,
-                        extra_env=get_storage_env(repo, primary_storage_name)
+                        extra_env=primary_env,
+                        max_stdout_lines=BACKUP_STDOUT_TAIL_LINES,
                     )
 
                     replication = repo.get("replication") or {}
-                    if result["code"] == 0 and replication.get("enabled") and replication.get("to"):
-                        from_storage = replication.get("from") or primary.get("name")
-                        to_storage = replication["to"]
-                        if req.repoId in active_backups:
-                            active_backups[req.repoId]["lastOutput"] = "Replicando backup a Wasabi S3..."
+                    repl_enabled, repl_from, repl_to = replication.get("enabled"), replication.get("from"), replication.get("to")
+                    if result["code"] == 0 and repl_enabled and repl_to:
+                        from_storage = repl_from or primary.get("name")
+                        to_storage = repl_to
+                        backup_info["lastOutput"] = "Replicando backup a Wasabi S3..."
                         logger.info(
                             "[Backup] Replicacion repo=%s desde=%s hacia=%s",
                             req.repoId,
@@ -461,68 +493,86 @@ async def start_backup(req: BackupStart):
                             password=effective_password,
                             on_progress=on_progress,
                             on_process_start=on_process_start,
-                            extra_env=get_storage_env(repo, to_storage)
+                            extra_env=get_storage_env(repo, to_storage) if to_storage != primary_storage_name else primary_env,
+                            max_stdout_lines=BACKUP_STDOUT_TAIL_LINES,
                         )
                         if copy_result["code"] != 0:
                             result = {
                                 "code": copy_result["code"],
-                                "stdout": (result.get("stdout") or "") + "\n\n--- COPY TO WASABI ---\n" + (copy_result.get("stdout") or copy_result.get("stderr") or ""),
+                                "stdout": "".join((
+                                    result.get("stdout") or "",
+                                    "\n\n--- COPY TO WASABI ---\n",
+                                    copy_result.get("stdout") or copy_result.get("stderr") or "",
+                                )),
                                 "stderr": copy_result.get("stderr", "")
                             }
                         else:
-                            result["stdout"] = (result.get("stdout") or "") + "\n\n--- COPY TO WASABI OK ---\n" + (copy_result.get("stdout") or "")
+                            result["stdout"] = "".join((
+                                result.get("stdout") or "",
+                                "\n\n--- COPY TO WASABI OK ---\n",
+                                copy_result.get("stdout") or "",
+                            ))
 
                     if result.get("code") == 0 and primary_storage_name:
-                        try:
-                            backup_summary = await build_backup_change_summary(
-                                repo,
-                                storage_name=primary_storage_name,
-                                password=effective_password,
-                                pre_latest_revision=pre_latest_revision,
-                            )
-                            if req.repoId in active_backups and backup_summary:
-                                active_backups[req.repoId]["backupSummary"] = backup_summary
-                            if backup_summary.get("ok"):
-                                logger.info(
-                                    "[Backup] Resumen repo=%s rev=%s prev=%s total=%s nuevos=%s cambiados=%s eliminados=%s",
-                                    req.repoId,
-                                    backup_summary.get("createdRevision"),
-                                    backup_summary.get("previousRevision"),
-                                    backup_summary.get("fileCount", "—"),
-                                    backup_summary.get("new"),
-                                    backup_summary.get("changed"),
-                                    backup_summary.get("deleted"),
-                                )
-                                samples = backup_summary.get("samples") or {}
-                                sample_parts = []
-                                for key, label in (("new", "nuevos"), ("changed", "cambiados"), ("deleted", "eliminados")):
-                                    vals = samples.get(key) or []
-                                    if vals:
-                                        sample_parts.append(f"{label}: {', '.join(vals[:5])}")
-                                if sample_parts:
-                                    logger.info("[Backup] Muestra repo=%s %s", req.repoId, " | ".join(sample_parts))
-                            else:
-                                logger.warning(
-                                    "[Backup] Resumen no disponible repo=%s motivo=%s",
-                                    req.repoId,
-                                    backup_summary.get("message") or backup_summary.get("detail") or "desconocido",
+                        # El resumen (list + list -files) corre en paralelo con la persistencia del estado.
+                        async def compute_backup_summary():
+                            try:
+                                backup_summary = await build_backup_change_summary(
+                                    repo,
+                                    storage_name=primary_storage_name,
+                                    password=effective_password,
+                                    pre_latest_revision=pre_latest_revision,
+                                    extra_env=primary_env,
                                 )
-                        except Exception:
-                            logger.exception("[Backup] Error calculando resumen de cambios repo=%s", req.repoId)
+                                if backup_summary:
+                                    backup_info["backupSummary"] = backup_summary
+                                if backup_summary.get("ok"):
+                                    logger.info(
+                                        "[Backup] Resumen repo=%s rev=%s prev=%s total=%s nuevos=%s cambiados=%s eliminados=%s",
+                                        req.repoId,
+                                        backup_summary.get("createdRevision"),
+                                        backup_summary.get("previousRevision"),
+                                        backup_summary.get("fileCount", "—"),
+                                        backup_summary.get("new"),
+                                        backup_summary.get("changed"),
+                                        backup_summary.get("deleted"),
+                                    )
+                                    samples = backup_summary.get("samples") or {}
+                                    sample_parts = []
+                                    for key, label in (("new", "nuevos"), ("changed", "cambiados"), ("deleted", "eliminados")):
+                                        vals = samples.get(key) or []
+                                        if vals:
+                                            sample_parts.append(f"{label}: {', '.join(vals[:5])}")
+                                    if sample_parts:
+                                        logger.info("[Backup] Muestra repo=%s %s", req.repoId, " | ".join(sample_parts))
+                                else:
+                                    logger.warning(
+                                        "[Backup] Resumen no disponible repo=%s motivo=%s",
+                                        req.repoId,
+                                        backup_summary.get("message") or backup_summary.get("detail") or "desconocido",
+                                    )
+                            except Exception:
+                                logger.exception("[Backup] Error calculando resumen de cambios repo=%s", req.repoId)
+
+                        summary_task = asyncio.create_task(compute_backup_summary())
+
+            # Marca de fin única para lastBackup, schedule.lastRunAt, notificación y completed_backups
+            finished_at_iso = datetime.now().isoformat()
+            was_cancelled = bool(backup_info.get("cancelRequested"))
+            backup_summary_payload = backup_info.get("backupSummary")
+            final_status = "cancelled" if was_cancelled else ("success" if result["code"] == 0 else "error")
 
             # Update repo info securely via atomic_update
             def update_last_backup(all_repos):
                 for r in all_repos:
                     if r["id"] == req.repoId:
-                        r["lastBackup"] = datetime.now().isoformat()
-                        was_cancelled = bool((active_backups.get(req.repoId) or {}).get("cancelRequested"))
-                        final_status = "cancelled" if was_cancelled else ("success" if result["code"] == 0 else "error")
+                        r["lastBackup"] = finished_at_iso
                         r["lastBackupStatus"] = final_status
                         r["lastBackupTrigger"] = trigger
                         r["lastBackupOutput"] = result["stdout"][-500:]
-                        r["lastBackupSummary"] = (active_backups.get(req.repoId) or {}).get("backupSummary")
+                        r["lastBackupSummary"] = backup_summary_payload
                         if isinstance(r.get("schedule"), dict):
-                            r["schedule"]["lastRunAt"] = datetime.now().isoformat()
+                            r["schedule"]["lastRunAt"] = finished_at_iso
                             r["schedule"]["lastRunStatus"] = final_status
                             if final_status == "success":
                                 r["schedule"]["lastError"] = None
@@ -531,11 +581,28 @@ async def start_backup(req: BackupStart):
                         break
                 return all_repos
 
-            repositories_config.atomic_update(update_last_backup)
+            # Debounced: varias finalizaciones seguidas (scheduler) se agrupan en una escritura
+            await repositories_config.atomic_update_debounced(update_last_backup)
+
+            # El estado ya está persistido; ahora esperar el resumen y guardarlo aparte.
+            if summary_task is not None:
+                try:
+                    await asyncio.wait_for(summary_task, timeout=BACKUP_SUMMARY_TIMEOUT_SECONDS)
+                except asyncio.TimeoutError:
+                    logger.warning("[Backup] Tiempo agotado calculando resumen de cambios repo=%s", req.repoId)
+                    backup_info["backupSummary"] = {"ok": False, "message": "Tiempo agotado calculando el resumen de cambios"}
+                backup_summary_payload = backup_info.get("backupSummary")
+                if backup_summary_payload:
+                    def update_last_backup_summary(all_repos):
+                        for r in all_repos:
+                            if r["id"] == req.repoId:
+                                r["lastBackupSummary"] = backup_summary_payload
+                                break
+                        return all_repos
+
+                    await repositories_config.atomic_update_debounced(update_last_backup_summary)
 
             duration = round(time.monotonic() - started_monotonic, 2)
-            was_cancelled = bool((active_backups.get(req.repoId) or {}).get("cancelRequested"))
-            backup_summary_payload = (active_backups.get(req.repoId) or {}).get("backupSummary")
             logger.info(
                 "[Backup] Fin repo=%s nombre=%s resultado=%s codigo=%s duracion_s=%s",
                 req.repoId,
@@ -556,7 +623,6 @@ async def start_backup(req: BackupStart):
             if result.get("code") == 0 and not was_cancelled:
                 try:
                     primary_storage = get_primary_storage(repo) or {}
-                    output_lines = (active_backups.get(req.repoId) or {}).get("outputLines") or []
                     backup_log_text = "\n".join([str(x) for x in output_lines if str(x).strip()])
                     if result.get("stdout"):
                         backup_log_text = (backup_log_text + ("\n" if backup_log_text else "") + str(result.get("stdout") or "")).strip()
@@ -568,7 +634,7 @@ async def start_backup(req: BackupStart):
                         "sourcePath": repo.get("path"),
                         "targetUrl": (primary_storage.get("url") or repo.get("storageUrl") or ""),
                         "targetLabel": describe_storage(repo),
-                        "finishedAt": datetime.now().isoformat(),
+                        "finishedAt": finished_at_iso,
                         "durationSeconds": duration,
                         "backupSummary": backup_summary_payload,
                         "backupLog": backup_log_text,
@@ -584,7 +650,7 @@ async def start_backup(req: BackupStart):
                 "code": result.get("code", -1),
                 "stdout": result.get("stdout", "") or "",
                 "stderr": result.get("stderr", "") or "",
-                "finishedAt": datetime.now().isoformat(),
+                "finishedAt": finished_at_iso,
                 "canceled": was_cancelled,
                 "backupSummary": backup_summary_payload,
                 "trigger": trigger,
@@ -602,19 +668,14 @@ async def start_backup(req: BackupStart):
                 "code": result.get("code", -1),
                 "stdout": result.get("stdout", "") or "",
                 "stderr": result.get("stderr", "") or "",
-                "finishedAt": datetime.now().isoformat(),
-                "backupSummary": (active_backups.get(req.repoId) or {}).get("backupSummary"),
+                "finishedAt": finished_at_iso or datetime.now().isoformat(),
+                "backupSummary": backup_info.get("backupSummary"),
                 "trigger": trigger,
             }
         finally:
             # Invalidate repo-related caches after backup attempt (success or error)
             # to ensure the next list call gets fresh data
-            keys_to_remove = []
-            for k in remote_storage_list_cache.keys():
-                if k.startswith(f"repo-snapshots||{req.repoId}||") or k.startswith(f"repo-files||{req.repoId}||"):
-                    keys_to_remove.append(k)
-            for k in keys_to_remove:
-                remote_storage_list_cache.pop(k, None)
+            remote_storage_list_cache.invalidate_repo(req.repoId)
 
             active_backup_processes.pop(req.repoId, None)
             active_backups.pop(req.repoId, None)
@@ -640,23 +701,22 @@ async def cancel_backup(req: BackupCancelRequest):
     if not proc:
         raise HTTPException(status_code=409, detail="No se encontró el proceso del backup en ejecución")
 
-    active_backups[req.repoId]["cancelRequested"] = True
-    active_backups[req.repoId]["lastOutput"] = "Cancelación solicitada por el usuario..."
-    active_backups[req.repoId].setdefault("outputLines", []).append("⏹ Cancelación solicitada por el usuario...")
+    info["cancelRequested"] = True
+    info["lastOutput"] = "Cancelación solicitada por el usuario..."
+    info["outputLines"].append("⏹ Cancelación solicitada por el usuario...")
 
+    pid = getattr(proc, "pid", None)
     try:
         proc.terminate()
-    except Exception:
-        pid = getattr(proc, "pid", None)
+    except Exception as term_exc:
+        if not pid:
+            raise HTTPException(status_code=500, detail="No se pudo cancelar el backup: PID no disponible") from term_exc
         try:
-            if pid:
-                os.kill(pid, signal.SIGTERM)
-            else:
-                raise RuntimeError("PID no disponible")
-        except Exception as exc:
-            raise HTTPException(status_code=500, detail=f"No se pudo cancelar el backup: {exc}")
+            os.kill(pid, signal.SIGTERM)
+        except Exception as kill_exc:
+            raise HTTPException(status_code=500, detail=f"No se pudo cancelar el backup: {kill_exc}") from kill_exc
 
-    logger.info("[Backup] Cancelacion solicitada repo=%s pid=%s", req.repoId, getattr(proc, "pid", None))
+    logger.info("[Backup] Cancelacion solicitada repo=%s pid=%s", req.repoId, pid)
     return {"ok": True, "message": "Cancelación solicitada"}
 
 @router.get("/api/backup/progress/{repo_id}")
@@ -666,13 +726,13 @@ async def backup_progress(repo_id: str):
         while True:
             info = active_backups.get(repo_id)
             if info:
-                lines = info.get("outputLines") or []
-                if sent_lines < len(lines):
-                    chunk = "\n".join(lines[sent_lines:])
-                    sent_lines = len(lines)
+                lines = info.get("outputLines")
+                if lines is not None and sent_lines < lines.total:
+                    new_lines, sent_lines = lines.since(sent_lines)
+                    chunk = "\n".join(new_lines)
                     yield f"data: {json.dumps({'running': True, 'output': chunk})}\n\n"
                 else:
-                    yield f"data: {json.dumps({'running': True})}\n\n"
+                    yield SSE_RUNNING
                 await asyncio.sleep(1)
                 continue
 
@@ -689,7 +749,7 @@ async def backup_progress(repo_id: str):
                 yield f"data: {json.dumps(payload)}\n\n"
                 break
 
-            yield f"data: {json.dumps({'done': True})}\n\n"
+            yield SSE_DONE
             await asyncio.sleep(1)
             break
 
@@ -1,29 +1,53 @@
 import os
 import signal
 import time
-import hashlib
 import asyncio
-import json
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import List, Optional, Dict, Any
+from typing import Optional, Dict, Any
 from fastapi import APIRouter, HTTPException
-from fastapi.responses import StreamingResponse
-from server_py.utils.config_store import repositories as repositories_config
+from fastapi.responses import Response, StreamingResponse
 from server_py.models.schemas import RestoreRequest, RestoreCancelRequest
 from server_py.services.duplicacy import service as duplicacy_service
 from server_py.core.helpers import (
     get_primary_storage, get_storage_env, describe_storage,
     summarize_path_selection, ensure_restore_target_initialized,
-    _remote_cache_key, _remote_cache_get, _remote_cache_set, 
-    get_repo_duplicacy_password,
-    FIXED_DUPLICACY_THREADS, logger, config_store
+    _remote_cache_key, _remote_cache_get_bytes, _remote_cache_set, _pw_fingerprint, single_flight,
+    get_repo_duplicacy_password, get_repo_by_id, normalized_abs_path, ProgressFeed,
+    FIXED_DUPLICACY_THREADS, restore_progress_events, logger, config_store
 )
 
 router = APIRouter(tags=["restore"])
-active_restore_processes: Dict[str, Any] = {}
-active_restore_cancel_flags: Dict[str, bool] = {}
-active_restores: Dict[str, Dict[str, Any]] = {}
-completed_restores: Dict[str, Dict[str, Any]] = {}
+# Cola de salida retenida por restore (los lectores SSE avanzan con OutputLines.total).
+RESTORE_OUTPUT_LINES_MAXLEN = 10_000
+
+
+@dataclass
+class RestoreState:
+    """Estado de un restore por repo: en curso mientras `completed` es None, después su resultado.
+
+    La salida en vivo va aparte en `progress`: on_progress solo toca ese objeto.
+    """
+
+    started_at: str
+    revision: int
+    restore_path: Optional[str]
+    progress: ProgressFeed = field(
+        default_factory=lambda: ProgressFeed(RESTORE_OUTPUT_LINES_MAXLEN, "Iniciando restauración...")
+    )
+    status: str = "running"
+    cancel_requested: bool = False
+    proc: Any = None
+    pid: Optional[int] = None
+    completed: Optional[Dict[str, Any]] = None
+
+    @property
+    def running(self) -> bool:
+        return self.completed is None
+
+
+# Un único registro por repo; el SSE lo retira al entregar el resultado final.
+restores: Dict[str, RestoreState] = {}
 
 
 def _terminate_restore_process(proc: Any) -> None:
@@ -39,6 +63,36 @@ def _terminate_restore_process(proc: Any) -> None:
     except Exception:
         pass
 
+def _watch_restore_process_exit(state: RestoreState, proc: Any) -> bool:
+    """Avisa a los lectores SSE en cuanto el proceso cancelado sale, vía pidfd (Linux >= 5.3).
+
+    En otras plataformas (Windows/macOS) retorna False y el fin se detecta como siempre, al
+    completar duplicacy_service.restore.
+    """
+    pidfd_open = getattr(os, "pidfd_open", None)
+    pid = getattr(proc, "pid", None)
+    if pidfd_open is None or not pid:
+        return False
+    try:
+        loop = asyncio.get_running_loop()
+        fd = pidfd_open(pid)
+    except (OSError, RuntimeError):
+        # Ya terminó (ProcessLookupError) o no hay loop/soporte.
+        return False
+
+    def on_exit() -> None:
+        loop.remove_reader(fd)
+        os.close(fd)
+        if state.running:
+            state.progress.push("⏹ Proceso de restauración detenido")
+
+    try:
+        loop.add_reader(fd, on_exit)
+    except (NotImplementedError, OSError):
+        os.close(fd)
+        return False
+    return True
+
 # --- Snapshots & Restore ---
 
 @router.get("/api/snapshots/{repo_id}")
@@ -48,13 +102,11 @@ async def list_snapshots(
     storage: Optional[str] = None,
     refresh: bool = False,
 ):
-    repos_data = config_store.repositories.read()
-    repo_ids = [r.get("id") for r in repos_data]
-    logger.info(f"[Snapshots] Solicitando {repo_id} | IDs en BD: {repo_ids}")
-    
-    repo = next((r for r in repos_data if r["id"] == repo_id), None)
+    repo = await get_repo_by_id(repo_id)
+    logger.info(f"[Snapshots] Solicitando {repo_id}")
     if not repo:
-        logger.warning(f"[Snapshots] No se encuentra {repo_id} en la lista {repo_ids}")
+        _, repos_by_id = await asyncio.to_thread(config_store.repositories.read_as_map)
+        logger.warning(f"[Snapshots] No se encuentra {repo_id} en la lista {list(repos_by_id)}")
         raise HTTPException(status_code=404, detail=f"Repository not found: {repo_id}")
 
     storage_name = storage or (get_primary_storage(repo) or {}).get("name")
@@ -67,32 +119,34 @@ async def list_snapshots(
         "repo-snapshots",
         repo_id,
         storage_name,
-        bool(effective_password),
-        hashlib.sha256((effective_password or "").encode("utf-8")).hexdigest() if effective_password else "",
+        _pw_fingerprint(effective_password or ""),
     )
-    cached = None if refresh else _remote_cache_get(cache_key)
+    cached = None if refresh else _remote_cache_get_bytes(cache_key)
     if cached is not None:
-        return cached
+        return Response(content=cached, media_type="application/json")
 
-    result = await duplicacy_service.list_snapshots(
-        repo["path"],
-        password=effective_password,
-        storage_name=storage_name,
-        extra_env=get_storage_env(repo, storage_name)
-    )
-    
-    if result["code"] != 0:
-        raise HTTPException(status_code=500, detail=result.get("stdout") or result.get("stderr") or "No se pudieron listar snapshots")
-    
-    payload = {"ok": True, "snapshots": result["snapshots"]}
-    _remote_cache_set(cache_key, payload)
-    return payload
+    async def fetch_snapshots() -> bytes:
+        result = await duplicacy_service.list_snapshots(
+            repo["path"],
+            password=effective_password,
+            storage_name=storage_name,
+            extra_env=get_storage_env(repo, storage_name)
+        )
+
+        if result["code"] != 0:
+            raise HTTPException(status_code=500, detail=result.get("stdout") or result.get("stderr") or "No se pudieron listar snapshots")
+
+        payload = {"ok": True, "snapshots": result["snapshots"]}
+        _remote_cache_set(cache_key, payload)
+        return _remote_cache_get_bytes(cache_key)
+
+    # Varias pestañas pidiendo lo mismo comparten una sola ejecución de duplicacy sobre el repo.
+    return Response(content=await single_flight(cache_key, fetch_snapshots), media_type="application/json")
 
 
 @router.get("/api/snapshots/{repo_id}/files")
 async def list_snapshot_files(repo_id: str, revision: int, password: Optional[str] = None, storage: Optional[str] = None):
-    repos_data = config_store.repositories.read()
-    repo = next((r for r in repos_data if r["id"] == repo_id), None)
+    repo = await get_repo_by_id(repo_id)
     if not repo:
         raise HTTPException(status_code=404, detail="Repository not found")
 
@@ -107,35 +161,37 @@ async def list_snapshot_files(repo_id: str, revision: int, password: Optional[st
         repo_id,
         storage_name,
         revision,
-        bool(effective_password),
-        hashlib.sha256((effective_password or "").encode("utf-8")).hexdigest() if effective_password else "",
+        _pw_fingerprint(effective_password or ""),
     )
-    cached = _remote_cache_get(cache_key)
+    cached = _remote_cache_get_bytes(cache_key)
     if cached is not None:
-        return cached
-
-    result = await duplicacy_service.list_files(
-        repo["path"],
-        revision=revision,
-        password=effective_password,
-        storage_name=storage_name,
-        extra_env=get_storage_env(repo, storage_name),
-    )
-    if result["code"] != 0:
-        raise HTTPException(status_code=500, detail=result.get("stdout") or result.get("stderr") or "No se pudo listar archivos")
-    
-    payload = {"ok": True, "files": result["files"]}
-    _remote_cache_set(cache_key, payload)
-    return payload
+        return Response(content=cached, media_type="application/json")
+
+    async def fetch_files() -> bytes:
+        result = await duplicacy_service.list_files(
+            repo["path"],
+            revision=revision,
+            password=effective_password,
+            storage_name=storage_name,
+            extra_env=get_storage_env(repo, storage_name),
+        )
+        if result["code"] != 0:
+            raise HTTPException(status_code=500, detail=result.get("stdout") or result.get("stderr") or "No se pudo listar archivos")
+
+        payload = {"ok": True, "files": result["files"]}
+        _remote_cache_set(cache_key, payload)
+        return _remote_cache_get_bytes(cache_key)
+
+    return Response(content=await single_flight(cache_key, fetch_files), media_type="application/json")
 
 @router.post("/api/restore")
 async def restore(req: RestoreRequest):
-    repos_data = config_store.repositories.read()
-    repo = next((r for r in repos_data if r["id"] == req.repoId), None)
+    repo = await get_repo_by_id(req.repoId)
     if not repo:
         raise HTTPException(status_code=404, detail="Repository not found")
 
-    if req.repoId in active_restores:
+    current = restores.get(req.repoId)
+    if current is not None and current.running:
         raise HTTPException(status_code=409, detail="Ya hay una restauración en ejecución para ese backup")
 
     started_monotonic = time.monotonic()
@@ -157,37 +213,31 @@ async def restore(req: RestoreRequest):
     # Auto-recuperar password
     effective_password = req.password or get_repo_duplicacy_password(repo, storage_name)
 
-    active_restores[req.repoId] = {
-        "status": "running",
-        "startedAt": datetime.now().isoformat(),
-        "lastOutput": "Iniciando restauración...",
-        "outputLines": [],
-        "cancelRequested": False,
-        "revision": req.revision,
-        "restorePath": restore_path or repo.get("path"),
-    }
-    active_restore_cancel_flags[req.repoId] = False
-    completed_restores.pop(req.repoId, None)
+    state = RestoreState(
+        started_at=datetime.now().isoformat(),
+        revision=req.revision,
+        restore_path=restore_path or repo.get("path"),
+    )
+    restores[req.repoId] = state
 
     async def run_restore_task():
         result: Dict[str, Any] = {"code": -1, "stdout": "", "stderr": "Error no especificado"}
         local_working_path = working_path
         started_task_monotonic = time.monotonic()
 
+        progress = state.progress
+
         def on_progress(text: str):
-            if req.repoId in active_restores:
-                clean = (text or "").rstrip("\r\n")
-                if clean:
-                    active_restores[req.repoId]["lastOutput"] = clean
-                    active_restores[req.repoId].setdefault("outputLines", []).append(clean)
+            clean = text.rstrip("\r\n") if text else ""
+            if clean:
+                progress.push(clean)
 
         def on_process_start(proc: Any):
-            active_restore_processes[req.repoId] = proc
-            if req.repoId in active_restores:
-                active_restores[req.repoId]["pid"] = getattr(proc, "pid", None)
+            state.proc = proc
+            state.pid = getattr(proc, "pid", None)
 
         try:
-            if restore_path and os.path.normcase(os.path.abspath(restore_path)) != os.path.normcase(os.path.abspath(repo["path"])):
+            if restore_path and normalized_abs_path(restore_path) != normalized_abs_path(repo["path"]):
                 await ensure_restore_target_initialized(repo, restore_path, effective_password, storage_name)
                 local_working_path = restore_path
 
@@ -205,7 +255,7 @@ async def restore(req: RestoreRequest):
             )
 
             duration = round(time.monotonic() - started_task_monotonic, 2)
-            was_cancelled = bool((active_restores.get(req.repoId) or {}).get("cancelRequested")) or bool(active_restore_cancel_flags.get(req.repoId))
+            was_cancelled = state.cancel_requested
             if result.get("code") != 0 and not was_cancelled:
                 logger.error(
                     "[Restore] Fin repo=%s nombre=%s revision=%s resultado=ERROR codigo=%s duracion_s=%s",
@@ -227,7 +277,7 @@ async def restore(req: RestoreRequest):
                     local_working_path,
                 )
 
-            completed_restores[req.repoId] = {
+            state.completed = {
                 "done": True,
                 "code": result.get("code", -1),
                 "stdout": result.get("stdout", "") or "",
@@ -245,19 +295,29 @@ async def restore(req: RestoreRequest):
                 req.revision,
                 duration,
             )
-            completed_restores[req.repoId] = {
+            state.completed = {
                 "done": True,
                 "code": result.get("code", -1),
                 "stdout": result.get("stdout", "") or "",
                 "stderr": str(exc),
                 "finishedAt": datetime.now().isoformat(),
-                "canceled": bool((active_restores.get(req.repoId) or {}).get("cancelRequested")) or bool(active_restore_cancel_flags.get(req.repoId)),
+                "canceled": state.cancel_requested,
                 "restorePath": local_working_path,
             }
         finally:
-            active_restore_processes.pop(req.repoId, None)
-            active_restore_cancel_flags.pop(req.repoId, None)
-            active_restores.pop(req.repoId, None)
+            if state.completed is None:
+                state.completed = {
+                    "done": True,
+                    "code": -1,
+                    "stdout": "",
+                    "stderr": "Restauración interrumpida",
+                    "finishedAt": datetime.now().isoformat(),
+                    "canceled": state.cancel_requested,
+                    "restorePath": local_working_path,
+                }
+            state.status = "done"
+            state.proc = None
+            state.progress.signal.notify()
 
     asyncio.create_task(run_restore_task())
     return {"ok": True}
@@ -265,53 +325,20 @@ async def restore(req: RestoreRequest):
 
 @router.post("/api/restore/cancel")
 async def cancel_restore(req: RestoreCancelRequest):
-    info = active_restores.get(req.repoId)
-    if not info:
+    state = restores.get(req.repoId)
+    if state is None or not state.running:
         raise HTTPException(status_code=404, detail="No hay restauración en ejecución para ese backup")
-    info["cancelRequested"] = True
-    info["lastOutput"] = "Cancelación solicitada por el usuario..."
-    info.setdefault("outputLines", []).append("⏹ Cancelación solicitada por el usuario...")
-    proc = active_restore_processes.get(req.repoId)
+    state.cancel_requested = True
+    state.progress.push("⏹ Cancelación solicitada por el usuario...")
+    proc = state.proc
     if not proc:
         raise HTTPException(status_code=409, detail="No se encontró el proceso de restauración en ejecución")
-    active_restore_cancel_flags[req.repoId] = True
     _terminate_restore_process(proc)
+    _watch_restore_process_exit(state, proc)
     logger.warning("[Restore] Cancelación solicitada repo=%s", req.repoId)
     return {"ok": True, "message": "Cancelación de restauración solicitada"}
 
 
 @router.get("/api/restore/progress/{repo_id}")
 async def restore_progress(repo_id: str):
-    async def event_generator():
-        sent_lines = 0
-        while True:
-            info = active_restores.get(repo_id)
-            if info:
-                lines = info.get("outputLines") or []
-                if sent_lines < len(lines):
-                    chunk = "\n".join(lines[sent_lines:])
-                    sent_lines = len(lines)
-                    yield f"data: {json.dumps({'running': True, 'output': chunk})}\n\n"
-                else:
-                    yield f"data: {json.dumps({'running': True})}\n\n"
-                await asyncio.sleep(1)
-                continue
-
-            completed = completed_restores.pop(repo_id, None)
-            if completed:
-                payload = {
-                    "done": True,
-                    "success": completed.get("code", -1) == 0 and not completed.get("canceled"),
-                    "canceled": bool(completed.get("canceled")),
-                    "code": completed.get("code", -1),
-                    "finalOutput": completed.get("stdout", "") or completed.get("stderr", ""),
-                    "restorePath": completed.get("restorePath"),
-                }
-                yield f"data: {json.dumps(payload)}\n\n"
-                break
-
-            yield f"data: {json.dumps({'done': True})}\n\n"
-            await asyncio.sleep(1)
-            break
-
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+    return StreamingResponse(restore_progress_events(restores, repo_id), media_type="text/event-stream")
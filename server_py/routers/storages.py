@@ -1,15 +1,15 @@
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
+import copy
 import os
 import signal
 import asyncio
-import json
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
 import uuid
+import orjson
 import time
-import hashlib
-from datetime import datetime
-from server_py.utils.config_store import storages as storages_config
+from dataclasses import dataclass, field
+from server_py.utils.config_store import storages as storages_config, repositories as repositories_config
 from server_py.models.schemas import (
     StorageCreate,
     StorageUpdate,
@@ -20,54 +20,217 @@ from server_py.models.schemas import (
 from server_py.services.duplicacy import service as duplicacy_service
 from server_py.utils.secret_crypto import protect_secrets_deep, reveal_secret
 from server_py.core.helpers import (
-    sanitize_storage, list_all_storages_for_ui, test_wasabi_head_bucket, 
-    validate_wasabi_duplicacy_storage_access_if_initialized, build_wasabi_storage_url,
-    get_storage_by_id, _remote_cache_key, _remote_cache_get, _remote_cache_set,
+    sanitize_storage, sanitize_storages_cached, list_all_storages_for_ui,
+    check_wasabi_storage_access, build_wasabi_storage_url,
+    get_storage_by_id, _remote_cache_key, _remote_cache_get_bytes, _remote_cache_set, _pw_fingerprint, single_flight,
+    remote_storage_list_cache, _schedule_remote_cache_save,
     with_temp_storage_session_list_snapshots, with_temp_storage_session_list_files,
     ensure_restore_target_initialized_from_storage, get_storage_record_env, FIXED_DUPLICACY_THREADS,
-    summarize_path_selection, do_detect_wasabi_snapshots, logger
+    summarize_path_selection, do_detect_wasabi_snapshots, iso_now_seconds, OrjsonResponse, ProgressFeed,
+    restore_progress_events, logger
 )
 
-router = APIRouter(tags=["storages"])
-active_storage_restore_processes: Dict[str, Any] = {}
-active_storage_restore_cancel_flags: Dict[str, bool] = {}
-active_storage_restores: Dict[str, Dict[str, Any]] = {}
-completed_storage_restores: Dict[str, Dict[str, Any]] = {}
+router = APIRouter(tags=["storages"], default_response_class=OrjsonResponse)
+# Las versiones de config se reinician con el proceso: el prefijo evita reutilizar ETags de otra ejecución.
+_STORAGES_ETAG_PREFIX = uuid.uuid4().hex[:8]
+# (ETag, cuerpo JSON) del último listado de storages: mientras no cambie la config se sirve tal cual.
+_storages_listing: Optional[Tuple[str, bytes]] = None
+# La salida completa ya se emite en vivo por el SSE de progreso; el resultado final solo guarda la cola.
+STORAGE_RESTORE_STDOUT_TAIL_LINES = 200
+# Cota en caracteres de esa cola (finalOutput), por si alguna línea es enorme.
+STORAGE_RESTORE_FINAL_OUTPUT_MAX_CHARS = 256 * 1024
+# Líneas de salida retenidas para el SSE de progreso (los lectores avanzan con OutputLines.total).
+STORAGE_RESTORE_OUTPUT_LINES_MAXLEN = 5000
+
+
+@dataclass
+class StorageRestoreState:
+    """Estado de un restore desde storage: en curso mientras `completed` es None, después su resultado.
+
+    Mismo esquema que RestoreState (routers/restore.py): proceso, cancelación y resultado en un solo registro.
+    """
+
+    started_at: str
+    snapshot_id: str
+    revision: int
+    restore_path: str
+    progress: ProgressFeed = field(
+        default_factory=lambda: ProgressFeed(STORAGE_RESTORE_OUTPUT_LINES_MAXLEN, "Iniciando restauración...")
+    )
+    status: str = "running"
+    cancel_requested: bool = False
+    proc: Any = None
+    pid: Optional[int] = None
+    completed: Optional[Dict[str, Any]] = None
 
+    @property
+    def running(self) -> bool:
+        return self.completed is None
 
-def _terminate_storage_restore_process(proc: Any) -> None:
+
+# Un único registro por storage; el SSE lo retira al entregar el resultado final.
+storage_restores: Dict[str, StorageRestoreState] = {}
+
+
+# Espera entre escalones al cancelar un restore (SIGINT -> SIGTERM -> SIGKILL).
+STORAGE_RESTORE_TERMINATE_GRACE_SECONDS = 5.0
+
+
+def _signal_storage_restore_process(proc: Any, sig: int) -> bool:
+    """Envía `sig` si el proceso sigue vivo. Retorna False si ya había terminado."""
+    if getattr(proc, "returncode", None) is not None:
+        return False
     try:
-        proc.terminate()
-        return
+        proc.send_signal(sig)
+        return True
+    except ProcessLookupError:
+        return False
     except Exception:
         pass
+    pid = getattr(proc, "pid", None)
+    if not pid:
+        return False
     try:
-        pid = getattr(proc, "pid", None)
-        if pid:
-            os.kill(pid, signal.SIGTERM)
-    except Exception:
-        pass
+        os.kill(pid, sig)
+        return True
+    except OSError:
+        return False
+
+
+def _terminate_storage_restore_process(proc: Any) -> None:
+    """Cancela el restore: en POSIX primero SIGINT (salida ordenada de duplicacy) y, si sigue vivo
+    tras la espera, SIGTERM y luego SIGKILL. En Windows terminate() ya es TerminateProcess.
+    """
+    if os.name == "nt":
+        _signal_storage_restore_process(proc, signal.SIGTERM)
+        return
+    if not _signal_storage_restore_process(proc, signal.SIGINT):
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _signal_storage_restore_process(proc, signal.SIGTERM)
+        return
+
+    def escalate(sig: int, next_sig: Optional[int]) -> None:
+        if _signal_storage_restore_process(proc, sig) and next_sig is not None:
+            loop.call_later(STORAGE_RESTORE_TERMINATE_GRACE_SECONDS, escalate, next_sig, None)
+
+    loop.call_later(STORAGE_RESTORE_TERMINATE_GRACE_SECONDS, escalate, signal.SIGTERM, signal.SIGKILL)
+
+def _storage_url_key(storage: Dict[str, Any]) -> Tuple[Any, Any]:
+    return (storage.get("type"), storage.get("url") or storage.get("localPath"))
+
+
+# Sustituto de `_secrets` ausente: compartido, no se debe modificar.
+_EMPTY_SECRETS: Dict[str, Any] = {}
+
+
+def _stored_duplicacy_password(storage: Dict[str, Any]) -> Optional[str]:
+    return reveal_secret((storage.get("_secrets") or _EMPTY_SECRETS).get("duplicacyPassword")) or None
+
+
+def _stored_password_fingerprint(storage: Dict[str, Any]) -> str:
+    # Solo en memoria: reveal_secret y _pw_fingerprint ya están cacheados, no se guarda ninguna huella en disco.
+    return _pw_fingerprint(_stored_duplicacy_password(storage) or "")
+
+
+def _url_if_changed(target: Dict[str, Any], region: str, endpoint: str, bucket: str, directory: str) -> str:
+    """URL Wasabi del storage; solo se reconstruye si cambia alguno de los campos de los que depende."""
+    current_fields = (target.get("region") or "", target.get("endpoint") or "", target.get("bucket") or "", target.get("directory") or "")
+    if target.get("url") and (region, endpoint, bucket, directory) == current_fields:
+        return target["url"]
+    return build_wasabi_storage_url(region, endpoint, bucket, directory)
+
+
+def _invalidate_storage_listings(storage_id: str) -> None:
+    # Las claves de revisiones/archivos van por id de storage: si cambia su URL dejan de ser válidas.
+    if remote_storage_list_cache.invalidate_storage(storage_id):
+        _schedule_remote_cache_save()
+
 
 # --- Storages ---
 
+def _save_storage_record(
+    current: Optional[Dict[str, Any]],
+    record: Dict[str, Any],
+    validation: Dict[str, Any],
+    **extra: Any,
+) -> Dict[str, Any]:
+    """Escribe el registro (sustituye `current` o lo añade) y arma la respuesta. Síncrono: va en to_thread."""
+    if current is None:
+        record_key = _storage_url_key(record)
+
+        def _append(data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+            # Releída dentro del lock: otra alta concurrente del mismo destino no lo duplica.
+            if any(_storage_url_key(s) == record_key for s in data if isinstance(s, dict)):
+                return data
+            return [*data, record]
+
+        storages_config.atomic_update(_append)
+    else:
+        try:
+            # Sin cambios reales (p.ej. guardar el formulario tal cual) no se reescribe la config.
+            storages_config.update_one(current["id"], record)
+        except KeyError:
+            raise HTTPException(status_code=404, detail="Storage no encontrado")
+    response = {"ok": True, "storage": sanitize_storage(record), **extra}
+    if not validation.get("checked"):
+        response["warning"] = validation.get("message")
+    return response
+
+
+def _finalize_storage_create(record: Dict[str, Any], storage_type: str, validation: Dict[str, Any]) -> Dict[str, Any]:
+    """Deduplicado por URL + tipo y escritura del alta (parte síncrona de create_storage)."""
+    _, storages_by_url = storages_config.read_index("url", _storage_url_key)
+    current = storages_by_url.get(_storage_url_key(record))
+    if not current:
+        return _save_storage_record(None, record, validation)
+    # Ya existe: se actualizan alias/secretos. Los registros del índice son compartidos: se modifica una copia.
+    existing = copy.deepcopy(current)
+    existing["name"] = record["name"]
+    existing["label"] = record["label"]
+    if record.get("_secrets"):
+        existing.setdefault("_secrets", {}).update(record["_secrets"])
+    if storage_type == "wasabi":
+        for key in ("endpoint", "region", "bucket", "directory", "url"):
+            existing[key] = record.get(key)
+    else:
+        existing["localPath"] = record.get("localPath")
+        existing["url"] = record.get("url")
+    return _save_storage_record(current, existing, validation, updated=True)
+
+
 @router.get("/api/storages")
-async def get_storages():
-    return {"ok": True, "storages": [sanitize_storage(s) for s in list_all_storages_for_ui()]}
+async def get_storages(request: Request):
+    # El listado depende de storages y de los repos enlazados (linkedBackups).
+    etag = f'W/"{_STORAGES_ETAG_PREFIX}-{storages_config.version}-{repositories_config.version}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    global _storages_listing
+    cached = _storages_listing
+    if cached is None or cached[0] != etag:
+        body = orjson.dumps({"ok": True, "storages": sanitize_storages_cached(list_all_storages_for_ui())})
+        cached = _storages_listing = (etag, body)
+    return Response(content=cached[1], media_type="application/json", headers={"ETag": etag})
 
 
 @router.post("/api/storages")
 async def create_storage(req: StorageCreate):
-    storage_type = (req.type or "").strip().lower()
+    storage_type = (req.type or "").lower()
     if storage_type not in {"local", "wasabi"}:
         raise HTTPException(status_code=400, detail="type debe ser 'local' o 'wasabi'")
 
-    storages = storages_config.read()
-    name = (req.name or "").strip()
+    name = req.name or ""
     if not name:
         raise HTTPException(status_code=400, detail="El nombre del storage es obligatorio")
 
+    # Los storages locales no pasan validación remota.
+    validation: Dict[str, Any] = {"checked": True}
+    # Hora local sin zona, mismo formato que el resto de registros de config.
+    created_at = iso_now_seconds()
     if storage_type == "local":
-        local_path = (req.localPath or "").strip()
+        local_path = req.localPath or ""
         if not local_path:
             raise HTTPException(status_code=400, detail="Falta la ruta del storage local")
         url = local_path
@@ -78,23 +241,23 @@ async def create_storage(req: StorageCreate):
             "type": "local",
             "url": url,
             "localPath": local_path,
-            "createdAt": datetime.now().isoformat(),
+            "createdAt": created_at,
             "source": "managed",
         }
     else:
-        endpoint = (req.endpoint or "").strip()
-        region = (req.region or "").strip()
-        bucket = (req.bucket or "").strip()
-        directory = (req.directory or "").strip()
-        access_id = (req.accessId or "").strip()
-        access_key = (req.accessKey or "").strip()
+        # Los campos de texto llegan ya recortados (StorageCreate).
+        endpoint = req.endpoint or ""
+        region = req.region or ""
+        bucket = req.bucket or ""
+        directory = req.directory or ""
+        access_id = req.accessId or ""
+        access_key = req.accessKey or ""
         if not all([endpoint, region, bucket, access_id, access_key]):
             raise HTTPException(status_code=400, detail="Faltan campos de Wasabi para importar el storage")
 
-        # Validación básica de acceso al bucket
-        test_wasabi_head_bucket(endpoint, region, bucket, access_id, access_key)
+        # Validación de acceso al bucket y, si existe, del storage Duplicacy (en paralelo)
         dup_pwd = (req.duplicacyPassword or "").strip()
-        validation = await validate_wasabi_duplicacy_storage_access_if_initialized(
+        validation = await check_wasabi_storage_access(
             endpoint=endpoint,
             region=region,
             bucket=bucket,
@@ -114,7 +277,7 @@ async def create_storage(req: StorageCreate):
             "region": region,
             "bucket": bucket,
             "directory": directory,
-            "createdAt": datetime.now().isoformat(),
+            "createdAt": created_at,
             "source": "managed",
             "_secrets": {
                 "accessId": access_id,
@@ -125,124 +288,117 @@ async def create_storage(req: StorageCreate):
             record["_secrets"]["duplicacyPassword"] = req.duplicacyPassword
         record["_secrets"] = protect_secrets_deep(record.get("_secrets") or {})
 
-    # Deduplicado simple por URL + tipo (actualiza alias/secretos si ya existe)
-    existing = next((s for s in storages if s.get("type") == record.get("type") and (s.get("url") or s.get("localPath")) == (record.get("url") or record.get("localPath"))), None)
-    if existing:
-        existing["name"] = record["name"]
-        existing["label"] = record["label"]
-        if record.get("_secrets"):
-            record["_secrets"] = protect_secrets_deep(record.get("_secrets") or {})
-            existing.setdefault("_secrets", {}).update(record["_secrets"])
-        if storage_type == "wasabi":
-            for key in ("endpoint", "region", "bucket", "directory", "url"):
-                existing[key] = record.get(key)
-        else:
-            existing["localPath"] = record.get("localPath")
-            existing["url"] = record.get("url")
-        storages_config.write(storages)
-        response = {"ok": True, "storage": sanitize_storage(existing), "updated": True}
-        if storage_type == "wasabi" and 'validation' in locals() and not validation.get("checked"):
-            response["warning"] = validation.get("message")
-        return response
-
-    storages.append(record)
-    storages_config.write(storages)
-    response = {"ok": True, "storage": sanitize_storage(record)}
-    if storage_type == "wasabi" and 'validation' in locals() and not validation.get("checked"):
-        response["warning"] = validation.get("message")
-    return response
+    # Lectura, deduplicado y escritura son síncronos: se hacen en el threadpool.
+    return await asyncio.to_thread(_finalize_storage_create, record, storage_type, validation)
 
 
 @router.put("/api/storages/{storage_id}")
 async def update_storage(storage_id: str, req: StorageUpdate):
-    storages = storages_config.read()
-    target = next((s for s in storages if s.get("id") == storage_id), None)
-    if not target:
+    _, storages_by_id = await asyncio.to_thread(storages_config.read_as_map)
+    current = storages_by_id.get(storage_id)
+    if not current:
         raise HTTPException(status_code=404, detail="Storage no encontrado")
+    target = copy.deepcopy(current)
     if (target.get("source") or "managed") != "managed":
         raise HTTPException(status_code=400, detail="Los storages derivados (legacy) no se editan desde esta vista")
 
     storage_type = (target.get("type") or "").strip().lower()
-    new_name = (req.name or "").strip()
+    new_name = req.name or ""
     if new_name:
         target["name"] = new_name
         target["label"] = new_name
 
     if storage_type == "local":
         if req.localPath is not None:
-            new_local_path = (req.localPath or "").strip()
+            new_local_path = req.localPath or ""
             if not new_local_path:
                 raise HTTPException(status_code=400, detail="La ruta del storage local no puede estar vacía")
             target["localPath"] = new_local_path
             target["url"] = new_local_path
-        storages_config.write(storages)
-        return {"ok": True, "storage": sanitize_storage(target)}
+        response = await asyncio.to_thread(_save_storage_record, current, target, {"checked": True})
+        if target.get("url") != current.get("url"):
+            _invalidate_storage_listings(storage_id)
+        return response
 
     if storage_type != "wasabi":
         raise HTTPException(status_code=400, detail="Tipo de storage no soportado para edición")
 
     # Wasabi fields (blank => keep current)
-    endpoint = (req.endpoint or "").strip() if req.endpoint is not None else (target.get("endpoint") or "")
-    region = (req.region or "").strip() if req.region is not None else (target.get("region") or "")
-    bucket = (req.bucket or "").strip() if req.bucket is not None else (target.get("bucket") or "")
-    directory = (req.directory or "").strip() if req.directory is not None else (target.get("directory") or "")
+    endpoint = req.endpoint if req.endpoint is not None else (target.get("endpoint") or "")
+    region = req.region if req.region is not None else (target.get("region") or "")
+    bucket = req.bucket if req.bucket is not None else (target.get("bucket") or "")
+    directory = req.directory if req.directory is not None else (target.get("directory") or "")
     secrets = target.setdefault("_secrets", {})
-    access_id = (req.accessId or "").strip() if req.accessId is not None and (req.accessId or "").strip() else (reveal_secret(secrets.get("accessId")) or "")
-    access_key = (req.accessKey or "").strip() if req.accessKey is not None and (req.accessKey or "").strip() else (reveal_secret(secrets.get("accessKey")) or "")
+    access_id = req.accessId or (reveal_secret(secrets.get("accessId")) or "")
+    access_key = req.accessKey or (reveal_secret(secrets.get("accessKey")) or "")
 
     if not all([endpoint, region, bucket, access_id, access_key]):
         raise HTTPException(status_code=400, detail="Faltan datos de Wasabi (endpoint, región, bucket o credenciales)")
 
     # Validate access with resulting values
-    test_wasabi_head_bucket(endpoint, region, bucket, access_id, access_key)
     effective_dup_pwd = None
+    password_changed = True
     if req.clearDuplicacyPassword:
         effective_dup_pwd = None
     elif req.duplicacyPassword is not None and (req.duplicacyPassword or "").strip():
         effective_dup_pwd = req.duplicacyPassword
+        # Reenviar la misma contraseña (formulario sin tocar) no cuenta como cambio.
+        password_changed = effective_dup_pwd != reveal_secret(secrets.get("duplicacyPassword"))
     else:
         effective_dup_pwd = (reveal_secret(secrets.get("duplicacyPassword")) or None)
-    validation = await validate_wasabi_duplicacy_storage_access_if_initialized(
-        endpoint=endpoint,
-        region=region,
-        bucket=bucket,
-        directory=directory,
-        access_id=access_id,
-        access_key=access_key,
-        duplicacy_password=effective_dup_pwd,
+        password_changed = False
+
+    # Renombrar sin tocar la conexión ni la contraseña no repite las sondas remotas.
+    connection_unchanged = (
+        (endpoint, region, bucket, directory) == (target.get("endpoint") or "", target.get("region") or "", target.get("bucket") or "", target.get("directory") or "")
+        and access_id == (reveal_secret(secrets.get("accessId")) or "")
+        and access_key == (reveal_secret(secrets.get("accessKey")) or "")
     )
+    if connection_unchanged and not password_changed:
+        validation: Dict[str, Any] = {"checked": True}
+    else:
+        validation = await check_wasabi_storage_access(
+            endpoint=endpoint,
+            region=region,
+            bucket=bucket,
+            directory=directory,
+            access_id=access_id,
+            access_key=access_key,
+            duplicacy_password=effective_dup_pwd,
+        )
 
+    target["url"] = _url_if_changed(target, region, endpoint, bucket, directory)
     target["endpoint"] = endpoint
     target["region"] = region
     target["bucket"] = bucket
     target["directory"] = directory
-    target["url"] = build_wasabi_storage_url(region, endpoint, bucket, directory)
-    secrets["accessId"] = access_id
-    secrets["accessKey"] = access_key
+    # Solo se sustituyen los secretos que cambian: los que siguen igual conservan su valor ya
+    # protegido y protect_secrets_deep no vuelve a cifrarlos.
+    for key, value in (("accessId", access_id), ("accessKey", access_key)):
+        if value != (reveal_secret(secrets.get(key)) or ""):
+            secrets[key] = value
 
     if req.duplicacyPassword is not None:
         # blank means "keep current"; use clearDuplicacyPassword to remove explicitly
         if (req.duplicacyPassword or "").strip():
-            secrets["duplicacyPassword"] = req.duplicacyPassword
+            if req.duplicacyPassword != reveal_secret(secrets.get("duplicacyPassword")):
+                secrets["duplicacyPassword"] = req.duplicacyPassword
     if req.clearDuplicacyPassword:
         secrets.pop("duplicacyPassword", None)
     target["_secrets"] = protect_secrets_deep(secrets)
 
-    storages_config.write(storages)
-    response = {"ok": True, "storage": sanitize_storage(target)}
-    if not validation.get("checked"):
-        response["warning"] = validation.get("message")
+    response = await asyncio.to_thread(_save_storage_record, current, target, validation)
+    if target["url"] != current.get("url"):
+        _invalidate_storage_listings(storage_id)
     return response
 
 
 @router.delete("/api/storages/{storage_id}")
-async def delete_storage(storage_id: str):
-    storages = storages_config.read()
-    target = next((s for s in storages if s.get("id") == storage_id), None)
+def delete_storage(storage_id: str):
+    # Sin await: FastAPI ejecuta el handler en su threadpool y la escritura no bloquea el loop.
+    target = storages_config.delete_one(storage_id)
     if not target:
         raise HTTPException(status_code=404, detail="Storage no encontrado")
-    storages = [s for s in storages if s.get("id") != storage_id]
-    storages_config.write(storages)
     return {"ok": True, "removed": sanitize_storage(target)}
 
 
@@ -254,14 +410,15 @@ async def detect_storage_snapshots(storage_id: str):
     if (storage.get("type") or "").lower() != "wasabi":
         raise HTTPException(status_code=400, detail="La detección de Snapshot IDs está disponible en Wasabi (MVP)")
 
+    secrets = storage.get("_secrets") or _EMPTY_SECRETS
     req = WasabiSnapshotDetectRequest(
         endpoint=storage.get("endpoint") or "",
         region=storage.get("region") or "",
         bucket=storage.get("bucket") or "",
         directory=storage.get("directory") or "",
-        accessId=(reveal_secret((storage.get("_secrets") or {}).get("accessId")) or ""),
-        accessKey=(reveal_secret((storage.get("_secrets") or {}).get("accessKey")) or ""),
-        password=(reveal_secret((storage.get("_secrets") or {}).get("duplicacyPassword")) or None),
+        accessId=(reveal_secret(secrets.get("accessId")) or ""),
+        accessKey=(reveal_secret(secrets.get("accessKey")) or ""),
+        password=(reveal_secret(secrets.get("duplicacyPassword")) or None),
     )
     return await do_detect_wasabi_snapshots(req)
 
@@ -279,28 +436,33 @@ async def list_storage_snapshot_revisions(
     snapshot_id = (snapshot_id or "").strip()
     if not snapshot_id:
         raise HTTPException(status_code=400, detail="snapshot_id es obligatorio")
-    effective_password = (password or "").strip() or (reveal_secret((storage.get("_secrets") or {}).get("duplicacyPassword")) or None)
+    override_password = (password or "").strip() or None
     cache_key = _remote_cache_key(
         "storage-revisions",
         storage_id,
         snapshot_id,
-        bool(effective_password),
-        hashlib.sha256((effective_password or "").encode("utf-8")).hexdigest() if effective_password else "",
+        _pw_fingerprint(override_password) if override_password else _stored_password_fingerprint(storage),
     )
-    cached = None if refresh else _remote_cache_get(cache_key)
+    cached = None if refresh else _remote_cache_get_bytes(cache_key)
     if cached is not None:
-        return cached
-    result = await with_temp_storage_session_list_snapshots(
-        storage=storage,
-        snapshot_id=snapshot_id,
-        password=effective_password,
-    )
-    if result.get("code") != 0:
-        raise HTTPException(status_code=500, detail=result.get("stdout") or result.get("stderr") or "No se pudieron listar revisiones")
-    snapshots = [s for s in (result.get("snapshots") or []) if str(s.get("id") or "") == snapshot_id]
-    payload = {"ok": True, "snapshots": snapshots}
-    _remote_cache_set(cache_key, payload)
-    return payload
+        return Response(content=cached, media_type="application/json")
+
+    async def fetch_revisions() -> bytes:
+        effective_password = override_password or _stored_duplicacy_password(storage)
+        result = await with_temp_storage_session_list_snapshots(
+            storage=storage,
+            snapshot_id=snapshot_id,
+            password=effective_password,
+        )
+        if result.get("code") != 0:
+            raise HTTPException(status_code=500, detail=result.get("stdout") or result.get("stderr") or "No se pudieron listar revisiones")
+        snapshots = [s for s in (result.get("snapshots") or []) if str(s.get("id") or "") == snapshot_id]
+        payload = {"ok": True, "snapshots": snapshots}
+        _remote_cache_set(cache_key, payload)
+        return _remote_cache_get_bytes(cache_key)
+
+    # Peticiones simultáneas con la misma clave comparten una sola ejecución de duplicacy.
+    return Response(content=await single_flight(cache_key, fetch_revisions), media_type="application/json")
 
 
 @router.get("/api/storages/{storage_id}/snapshot-files")
@@ -311,36 +473,42 @@ async def list_storage_snapshot_files(storage_id: str, snapshot_id: str, revisio
     snapshot_id = (snapshot_id or "").strip()
     if not snapshot_id:
         raise HTTPException(status_code=400, detail="snapshot_id es obligatorio")
-    effective_password = (password or "").strip() or (reveal_secret((storage.get("_secrets") or {}).get("duplicacyPassword")) or None)
+    override_password = (password or "").strip() or None
     cache_key = _remote_cache_key(
         "storage-files",
         storage_id,
         snapshot_id,
         revision,
-        bool(effective_password),
-        hashlib.sha256((effective_password or "").encode("utf-8")).hexdigest() if effective_password else "",
+        _pw_fingerprint(override_password) if override_password else _stored_password_fingerprint(storage),
     )
-    cached = _remote_cache_get(cache_key)
+    # Los listados pueden ser grandes: la caché guarda el JSON ya codificado y un acierto no reserializa.
+    cached = _remote_cache_get_bytes(cache_key)
     if cached is not None:
-        return cached
-    result = await with_temp_storage_session_list_files(
-        storage=storage,
-        snapshot_id=snapshot_id,
-        revision=revision,
-        password=effective_password,
-    )
-    if result.get("code") != 0:
-        raise HTTPException(status_code=500, detail=result.get("stdout") or result.get("stderr") or "No se pudieron listar archivos")
-    payload = {"ok": True, "files": result.get("files") or []}
-    _remote_cache_set(cache_key, payload)
-    return payload
+        return Response(content=cached, media_type="application/json")
+
+    async def fetch_files() -> bytes:
+        effective_password = override_password or _stored_duplicacy_password(storage)
+        result = await with_temp_storage_session_list_files(
+            storage=storage,
+            snapshot_id=snapshot_id,
+            revision=revision,
+            password=effective_password,
+        )
+        if result.get("code") != 0:
+            raise HTTPException(status_code=500, detail=result.get("stdout") or result.get("stderr") or "No se pudieron listar archivos")
+        payload = {"ok": True, "files": result.get("files") or []}
+        _remote_cache_set(cache_key, payload)
+        return _remote_cache_get_bytes(cache_key)
+
+    return Response(content=await single_flight(cache_key, fetch_files), media_type="application/json")
 
 
 @router.post("/api/storages/{storage_id}/restore")
 async def restore_from_storage(storage_id: str, req: StorageRestoreRequest):
     if storage_id != req.storageId:
         raise HTTPException(status_code=400, detail="storageId de la URL y del body no coinciden")
-    if storage_id in active_storage_restores:
+    previous = storage_restores.get(storage_id)
+    if previous is not None and previous.running:
         raise HTTPException(status_code=409, detail="Ya hay una restauración en ejecución para este storage")
     storage = get_storage_by_id(storage_id)
     if not storage:
@@ -352,7 +520,7 @@ async def restore_from_storage(storage_id: str, req: StorageRestoreRequest):
     if not restore_path:
         raise HTTPException(status_code=400, detail="Para restaurar desde un storage sin backup local debes indicar una ruta de restauración")
 
-    effective_password = (req.password or "").strip() or (reveal_secret((storage.get("_secrets") or {}).get("duplicacyPassword")) or None)
+    override_password = (req.password or "").strip() or None
     logger.info(
         "[Restore] Inicio storage=%s snapshotId=%s revision=%s destino=%s overwrite=%s threads=%s seleccion=%s",
         storage.get("name") or storage.get("label") or storage_id,
@@ -363,36 +531,37 @@ async def restore_from_storage(storage_id: str, req: StorageRestoreRequest):
         FIXED_DUPLICACY_THREADS,
         summarize_path_selection(req.patterns),
     )
-    active_storage_restores[storage_id] = {
-        "status": "running",
-        "startedAt": datetime.now().isoformat(),
-        "lastOutput": "Iniciando restauración...",
-        "outputLines": [],
-        "cancelRequested": False,
-        "snapshotId": snapshot_id,
-        "revision": req.revision,
-        "restorePath": restore_path,
-    }
-    active_storage_restore_cancel_flags[storage_id] = False
-    completed_storage_restores.pop(storage_id, None)
+    # Sustituye también un resultado anterior que ningún SSE llegó a recoger.
+    state = StorageRestoreState(
+        started_at=iso_now_seconds(),
+        snapshot_id=snapshot_id,
+        revision=req.revision,
+        restore_path=restore_path,
+    )
+    storage_restores[storage_id] = state
+    progress = state.progress
 
     async def run_restore_storage_task():
         result: Dict[str, Any] = {"code": -1, "stdout": "", "stderr": "Error no especificado"}
         task_started_monotonic = time.monotonic()
 
         def on_progress(text: str):
-            if storage_id in active_storage_restores:
-                clean = (text or "").rstrip("\r\n")
-                if clean:
-                    active_storage_restores[storage_id]["lastOutput"] = clean
-                    active_storage_restores[storage_id].setdefault("outputLines", []).append(clean)
+            # progress se enlaza al inicio: sin búsquedas por línea.
+            clean = text.rstrip("\r\n") if text else ""
+            if clean:
+                progress.push(clean)
 
         def on_process_start(proc: Any):
-            active_storage_restore_processes[storage_id] = proc
-            if storage_id in active_storage_restores:
-                active_storage_restores[storage_id]["pid"] = getattr(proc, "pid", None)
+            state.proc = proc
+            state.pid = getattr(proc, "pid", None)
+
+        def prepare_credentials():
+            # reveal_secret puede llamar a DPAPI (Windows): se resuelve fuera del event loop.
+            password = override_password or _stored_duplicacy_password(storage)
+            return password, get_storage_record_env(storage, "default")
 
         try:
+            effective_password, extra_env = await asyncio.to_thread(prepare_credentials)
             await ensure_restore_target_initialized_from_storage(
                 storage=storage,
                 snapshot_id=snapshot_id,
@@ -405,15 +574,16 @@ async def restore_from_storage(storage_id: str, req: StorageRestoreRequest):
                 overwrite=req.overwrite,
                 password=effective_password,
                 storage_name="default",
-                extra_env=get_storage_record_env(storage, "default"),
+                extra_env=extra_env,
                 patterns=req.patterns or None,
                 threads=FIXED_DUPLICACY_THREADS,
                 on_progress=on_progress,
                 on_process_start=on_process_start,
+                max_stdout_lines=STORAGE_RESTORE_STDOUT_TAIL_LINES,
             )
 
             duration = round(time.monotonic() - task_started_monotonic, 2)
-            was_cancelled = bool((active_storage_restores.get(storage_id) or {}).get("cancelRequested")) or bool(active_storage_restore_cancel_flags.get(storage_id))
+            was_cancelled = state.cancel_requested
             if result.get("code") != 0 and not was_cancelled:
                 logger.error(
                     "[Restore] Fin storage=%s snapshotId=%s revision=%s resultado=ERROR codigo=%s duracion_s=%s",
@@ -435,12 +605,12 @@ async def restore_from_storage(storage_id: str, req: StorageRestoreRequest):
                     restore_path,
                 )
 
-            completed_storage_restores[storage_id] = {
+            state.completed = {
                 "done": True,
                 "code": result.get("code", -1),
-                "stdout": result.get("stdout", "") or "",
+                "stdout": (result.get("stdout", "") or "")[-STORAGE_RESTORE_FINAL_OUTPUT_MAX_CHARS:],
                 "stderr": result.get("stderr", "") or "",
-                "finishedAt": datetime.now().isoformat(),
+                "finishedAt": iso_now_seconds(),
                 "canceled": was_cancelled,
                 "restorePath": restore_path,
             }
@@ -453,19 +623,30 @@ async def restore_from_storage(storage_id: str, req: StorageRestoreRequest):
                 req.revision,
                 duration,
             )
-            completed_storage_restores[storage_id] = {
+            state.completed = {
                 "done": True,
                 "code": result.get("code", -1),
-                "stdout": result.get("stdout", "") or "",
+                "stdout": (result.get("stdout", "") or "")[-STORAGE_RESTORE_FINAL_OUTPUT_MAX_CHARS:],
                 "stderr": str(exc),
-                "finishedAt": datetime.now().isoformat(),
-                "canceled": bool((active_storage_restores.get(storage_id) or {}).get("cancelRequested")) or bool(active_storage_restore_cancel_flags.get(storage_id)),
+                "finishedAt": iso_now_seconds(),
+                "canceled": state.cancel_requested,
                 "restorePath": restore_path,
             }
         finally:
-            active_storage_restore_processes.pop(storage_id, None)
-            active_storage_restore_cancel_flags.pop(storage_id, None)
-            active_storage_restores.pop(storage_id, None)
+            state.proc = None
+            state.status = "done"
+            if state.completed is None:
+                # La tarea se canceló (p.ej. apagado): se cierra igualmente el estado para el SSE.
+                state.completed = {
+                    "done": True,
+                    "code": -1,
+                    "stdout": "",
+                    "stderr": "Restauración interrumpida",
+                    "canceled": state.cancel_requested,
+                    "restorePath": restore_path,
+                }
+            # Despierta a los lectores SSE para que envíen el resultado final.
+            progress.signal.notify()
 
     asyncio.create_task(run_restore_storage_task())
     return {"ok": True}
@@ -475,16 +656,14 @@ async def restore_from_storage(storage_id: str, req: StorageRestoreRequest):
 async def cancel_restore_from_storage(storage_id: str, req: StorageRestoreCancelRequest):
     if storage_id != req.storageId:
         raise HTTPException(status_code=400, detail="storageId de la URL y del body no coinciden")
-    info = active_storage_restores.get(storage_id)
-    if not info:
+    state = storage_restores.get(storage_id)
+    if state is None or not state.running:
         raise HTTPException(status_code=404, detail="No hay restauración en ejecución para este storage")
-    info["cancelRequested"] = True
-    info["lastOutput"] = "Cancelación solicitada por el usuario..."
-    info.setdefault("outputLines", []).append("⏹ Cancelación solicitada por el usuario...")
-    proc = active_storage_restore_processes.get(storage_id)
+    state.cancel_requested = True
+    state.progress.push("⏹ Cancelación solicitada por el usuario...")
+    proc = state.proc
     if not proc:
         raise HTTPException(status_code=409, detail="No se encontró el proceso de restauración en ejecución")
-    active_storage_restore_cancel_flags[storage_id] = True
     _terminate_storage_restore_process(proc)
     logger.warning("[Restore] Cancelación solicitada storage=%s", storage_id)
     return {"ok": True, "message": "Cancelación de restauración solicitada"}
@@ -492,37 +671,5 @@ async def cancel_restore_from_storage(storage_id: str, req: StorageRestoreCancel
 
 @router.get("/api/storages/{storage_id}/restore/progress")
 async def restore_from_storage_progress(storage_id: str):
-    async def event_generator():
-        sent_lines = 0
-        while True:
-            info = active_storage_restores.get(storage_id)
-            if info:
-                lines = info.get("outputLines") or []
-                if sent_lines < len(lines):
-                    chunk = "\n".join(lines[sent_lines:])
-                    sent_lines = len(lines)
-                    yield f"data: {json.dumps({'running': True, 'output': chunk})}\n\n"
-                else:
-                    yield f"data: {json.dumps({'running': True})}\n\n"
-                await asyncio.sleep(1)
-                continue
-
-            completed = completed_storage_restores.pop(storage_id, None)
-            if completed:
-                payload = {
-                    "done": True,
-                    "success": completed.get("code", -1) == 0 and not completed.get("canceled"),
-                    "canceled": bool(completed.get("canceled")),
-                    "code": completed.get("code", -1),
-                    "finalOutput": completed.get("stdout", "") or completed.get("stderr", ""),
-                    "restorePath": completed.get("restorePath"),
-                }
-                yield f"data: {json.dumps(payload)}\n\n"
-                break
-
-            yield f"data: {json.dumps({'done': True})}\n\n"
-            await asyncio.sleep(1)
-            break
-
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+    return StreamingResponse(restore_progress_events(storage_restores, storage_id), media_type="text/event-stream")
 
@@ -1,22 +1,23 @@
 import os
 import uuid
-import tempfile
 import asyncio
-import hashlib
 import json
 import re
+import time
 import urllib.request
 import urllib.error
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Optional, Dict, Any
+from pathlib import Path
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 from fastapi import APIRouter, HTTPException, Request, Response
-from fastapi.responses import PlainTextResponse
-from server_py.utils.config_store import settings as settings_config
-from server_py.utils.logger import get_log_files, read_log_file, get_logger
-from server_py.utils.paths import runtime_paths_info
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from server_py.utils.config_store import settings as settings_config, normalize_settings_aliases
+from server_py.utils.logger import get_log_files, read_log_file, resolve_log_path, get_logger
+from server_py.utils.paths import LOGS_DIR, runtime_paths_info
 from server_py.utils.secret_crypto import protect_secret, reveal_secret
 from server_py.models.schemas import WasabiConnectionTest, WasabiSnapshotDetectRequest
-from server_py.services.duplicacy import service as duplicacy_service
 from server_py.services.notifications import test_backup_notifications
 from server_py.services.secrets_migration import migrate_all_secrets_in_config
 from server_py.version import __version__ as APP_CODE_VERSION
@@ -36,17 +37,44 @@ from server_py.services.panel_auth import (
 )
 from server_py.core.helpers import (
     list_local_directory_items, test_wasabi_head_bucket, test_wasabi_write_bucket,
-    build_wasabi_storage_url, build_wasabi_env, _remote_cache_key, _remote_cache_get, _remote_cache_set,
-    scheduler_loop, scheduler_task
+    do_detect_wasabi_snapshots, wasabi_snapshots_cache_key, _remote_cache_get,
+    scheduler_loop, scheduler_task, acquire_scheduler_lock, iso_now_seconds, OrjsonResponse,
 )
 
 
-router = APIRouter(tags=["system"])
+router = APIRouter(tags=["system"], default_response_class=OrjsonResponse)
 logger = get_logger("SystemRouter")
 APP_VERSION = (os.getenv("DUPLIMANAGER_VERSION") or APP_CODE_VERSION).strip() or APP_CODE_VERSION
 DEFAULT_UPDATE_FEED_URL = "https://duplimanager.s3.eu-central-1.wasabisys.com/duplimanager/client/latest.json"
+# Los jobs de detección terminados se conservan este tiempo para que la UI recoja el resultado.
+WASABI_DETECT_JOB_RETENTION_SECONDS = 600
+
+# jobId -> {"cacheKey", "task", "finishedAt"}
+_wasabi_detect_jobs: Dict[str, Dict[str, Any]] = {}
+
+# Pools separados: las pruebas contra Wasabi (red, pueden tardar segundos) no compiten por hilos
+# con los listados de carpetas y la lectura de logs locales.
+_remote_io_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="dm-remote-io")
+_local_fs_pool = ThreadPoolExecutor(max_workers=min(8, (os.cpu_count() or 1) + 4), thread_name_prefix="dm-local-fs")
+# El diálogo de carpetas puede quedar abierto indefinidamente: hilo propio para no retener uno del
+# executor por defecto (config store, validaciones...). Con un solo hilo Tk nunca corre en dos a la vez.
+_folder_picker_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dm-folder-picker")
+
+
+async def _run_remote_io(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    return await asyncio.get_running_loop().run_in_executor(_remote_io_pool, partial(fn, *args, **kwargs))
+
+
+async def _run_local_fs(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    return await asyncio.get_running_loop().run_in_executor(_local_fs_pool, partial(fn, *args, **kwargs))
 
 LOG_LINE_RE = re.compile(r"^\[([^\]]+)\]\s+\[([^\]]+)\]\s+\[([^\]]+)\]\s*(.*)$")
+# Listado de logs: se reutiliza durante unos segundos y mientras no cambie el mtime del directorio.
+LOG_FILES_CACHE_TTL_SECONDS = 2.0
+_log_files_cache: Optional[Tuple[float, int, List[str]]] = None
+# Lectura en crudo de logs: bloques de 64 KiB y cabecera Range de un solo tramo.
+LOG_STREAM_CHUNK_BYTES = 64 * 1024
+BYTE_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
 
 
 def _client_ip(request: Optional[Request]) -> str:
@@ -255,12 +283,11 @@ async def health():
     return {
         "ok": True,
         "version": APP_VERSION,
-        "timestamp": datetime.now().isoformat()
+        "timestamp": iso_now_seconds(),
     }
 
 
-@router.get("/api/system/pick-folder")
-def pick_folder(start: Optional[str] = None):
+def _pick_folder_sync(start: Optional[str] = None) -> Dict[str, Any]:
     import sys
 
     if getattr(sys, "frozen", False):
@@ -294,14 +321,20 @@ def pick_folder(start: Optional[str] = None):
     return {"ok": True, "path": selected}
 
 
+@router.get("/api/system/pick-folder")
+async def pick_folder(start: Optional[str] = None):
+    return await asyncio.get_running_loop().run_in_executor(_folder_picker_pool, _pick_folder_sync, start)
+
+
 @router.get("/api/system/list-local-items")
-def list_local_items(root: str, relative: Optional[str] = ""):
-    return list_local_directory_items(root_path=root, relative_path=relative or "")
+async def list_local_items(root: str, relative: Optional[str] = ""):
+    return await _run_local_fs(list_local_directory_items, root_path=root, relative_path=relative or "")
 
 
 @router.post("/api/system/test-wasabi")
-def test_wasabi_connection(req: WasabiConnectionTest):
-    return test_wasabi_head_bucket(
+async def test_wasabi_connection(req: WasabiConnectionTest):
+    return await _run_remote_io(
+        test_wasabi_head_bucket,
         endpoint=req.endpoint,
         region=req.region,
         bucket=req.bucket,
@@ -311,8 +344,9 @@ def test_wasabi_connection(req: WasabiConnectionTest):
 
 
 @router.post("/api/system/test-wasabi-write")
-def test_wasabi_write(req: WasabiConnectionTest):
-    return test_wasabi_write_bucket(
+async def test_wasabi_write(req: WasabiConnectionTest):
+    return await _run_remote_io(
+        test_wasabi_write_bucket,
         endpoint=req.endpoint,
         region=req.region,
         bucket=req.bucket,
@@ -323,73 +357,58 @@ def test_wasabi_write(req: WasabiConnectionTest):
 
 @router.post("/api/system/detect-wasabi-snapshots")
 async def detect_wasabi_snapshots(req: WasabiSnapshotDetectRequest):
-    storage_url = build_wasabi_storage_url(req.region, req.endpoint, req.bucket, req.directory)
-    extra_env = build_wasabi_env(req.accessId, req.accessKey, "default")
-    password = (req.password or "").strip() or None
-    cache_key = _remote_cache_key(
-        "wasabi-snapshots",
-        storage_url,
-        bool(password),
-        hashlib.sha256((password or "").encode("utf-8")).hexdigest() if password else "",
-    )
+    return await do_detect_wasabi_snapshots(req)
+
+
+def _prune_wasabi_detect_jobs() -> None:
+    limit = time.monotonic() - WASABI_DETECT_JOB_RETENTION_SECONDS
+    for job_id in [k for k, job in _wasabi_detect_jobs.items() if job["task"].done() and job["finishedAt"] < limit]:
+        _wasabi_detect_jobs.pop(job_id, None)
+
+
+@router.post("/api/system/detect-wasabi-snapshots/jobs")
+async def start_detect_wasabi_snapshots_job(req: WasabiSnapshotDetectRequest):
+    """Lanza la detección en segundo plano y devuelve un jobId para consultar el resultado."""
+    _prune_wasabi_detect_jobs()
+    cache_key = wasabi_snapshots_cache_key(req)
+    # Peticiones idénticas mientras hay una en curso reutilizan el mismo job
+    for job_id, job in _wasabi_detect_jobs.items():
+        if job["cacheKey"] == cache_key and not job["task"].done():
+            return {"ok": True, "jobId": job_id, "status": "running"}
+    # Con la caché vigente no hace falta job: el resultado va en la misma respuesta
     cached = _remote_cache_get(cache_key)
     if cached is not None:
-        return cached
-    probe_snapshot_id = f"duplimanager-probe-{uuid.uuid4().hex[:8]}"
-
-    with tempfile.TemporaryDirectory(prefix="duplimanager-wasabi-probe-") as tmp_dir:
-        init_result = await duplicacy_service.init(
-            tmp_dir,
-            probe_snapshot_id,
-            storage_url,
-            password=password,
-            encrypt=(True if password else False),
-            extra_env=extra_env,
-        )
-        if init_result.get("code") != 0:
-            detail = (init_result.get("stdout") or init_result.get("stderr") or "No se pudo acceder al storage de Duplicacy")
-            if "likely to have been initialized with a password before" in detail:
-                raise HTTPException(
-                    status_code=400,
-                    detail="Este storage de Duplicacy parece cifrado. Introduce la contraseña de Duplicacy y vuelve a detectar Snapshot IDs.",
-                )
-            if "password is not correct" in detail.lower() or "invalid password" in detail.lower():
-                raise HTTPException(status_code=400, detail="La contraseña de Duplicacy no es correcta.")
-            raise HTTPException(status_code=400, detail=detail)
-
-        list_result = await duplicacy_service.list_snapshots(
-            tmp_dir,
-            password=password,
-            storage_name="default",
-            extra_env=extra_env,
-            all_ids=True,
-        )
-        if list_result.get("code") != 0:
-            detail = (list_result.get("stdout") or list_result.get("stderr") or "No se pudieron listar snapshots")
-            raise HTTPException(status_code=400, detail=detail)
-
-        snapshots = list_result.get("snapshots") or []
-        grouped: Dict[str, Dict[str, Any]] = {}
-        for s in snapshots:
-            sid = str(s.get("id") or "").strip()
-            if not sid:
-                continue
-            item = grouped.setdefault(sid, {"snapshotId": sid, "revisions": 0, "latestRevision": None, "latestCreatedAt": None})
-            item["revisions"] += 1
-            rev = s.get("revision")
-            if item["latestRevision"] is None or (isinstance(rev, int) and rev > item["latestRevision"]):
-                item["latestRevision"] = rev
-                item["latestCreatedAt"] = s.get("createdAt")
-
-        snapshot_ids = sorted(grouped.keys())
-        payload = {
-            "ok": True,
-            "storageUrl": storage_url,
-            "snapshotIds": snapshot_ids,
-            "snapshots": [grouped[k] for k in snapshot_ids],
-        }
-    _remote_cache_set(cache_key, payload)
-    return payload
+        return {"ok": True, "jobId": None, "status": "done", "result": cached}
+
+    job_id = uuid.uuid4().hex
+    job: Dict[str, Any] = {"cacheKey": cache_key, "task": asyncio.ensure_future(do_detect_wasabi_snapshots(req)), "finishedAt": 0.0}
+
+    def _done(task: "asyncio.Task[Any]") -> None:
+        job["finishedAt"] = time.monotonic()
+        if not task.cancelled():
+            task.exception()  # el resultado/error se entrega en el GET
+
+    job["task"].add_done_callback(_done)
+    _wasabi_detect_jobs[job_id] = job
+    return {"ok": True, "jobId": job_id, "status": "running"}
+
+
+@router.get("/api/system/detect-wasabi-snapshots/jobs/{job_id}")
+async def get_detect_wasabi_snapshots_job(job_id: str):
+    _prune_wasabi_detect_jobs()
+    job = _wasabi_detect_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo de detección no encontrado o caducado")
+    task = job["task"]
+    if not task.done():
+        return {"ok": True, "jobId": job_id, "status": "running"}
+    if task.cancelled():
+        return {"ok": False, "jobId": job_id, "status": "error", "detail": "La detección se canceló"}
+    exc = task.exception()
+    if exc is not None:
+        detail = exc.detail if isinstance(exc, HTTPException) else str(exc)
+        return {"ok": False, "jobId": job_id, "status": "error", "detail": detail}
+    return {"ok": True, "jobId": job_id, "status": "done", "result": task.result()}
 
 
 @router.post("/api/system/test-notification-channels")
@@ -564,7 +583,7 @@ async def get_system_paths():
 
 @router.get("/api/system/update-check")
 async def get_update_check():
-    s = settings_config.read() or {}
+    s = settings_config.read_shared() or {}
     updates = _get_effective_updates_config(s)
     enabled = bool(updates.get("enabled", True))
     url = str(updates.get("url") or "").strip()
@@ -614,12 +633,12 @@ async def get_update_check():
 
 # --- Config & Logs ---
 
+
 @router.get("/api/config/settings")
 async def get_settings():
-    s = settings_config.read()
+    # Copia superficial de la config compartida: más abajo los dicts anidados se copian antes de tocarlos
+    s = dict(settings_config.read_shared() or {})
     s["updates"] = _get_effective_updates_config(s)
-    if "duplicacyPath" not in s and "duplicacy_path" in s:
-        s["duplicacyPath"] = s.get("duplicacy_path")
     # Descifrar secretos que la UI necesita mostrar/reutilizar
     try:
         n = dict(s.get("notifications") or {})
@@ -641,21 +660,8 @@ async def get_settings():
 
 @router.put("/api/config/settings")
 async def update_settings(req: Request):
-    data = await req.json()
-    if "duplicacyPath" in data and "duplicacy_path" not in data:
-        data["duplicacy_path"] = data["duplicacyPath"]
-    if "duplicacy_path" in data and "duplicacyPath" not in data:
-        data["duplicacyPath"] = data["duplicacy_path"]
-    current = settings_config.read()
-    # La contraseña del panel se gestiona por endpoint dedicado
-    if isinstance(data.get("panelAccess"), dict):
-        incoming_panel_access = {
-            k: v for k, v in data["panelAccess"].items()
-            if k not in {"passwordBlob", "configured", "requiresAuth", "authenticated"}
-        }
-        merged_panel_access = dict(current.get("panelAccess") or {})
-        merged_panel_access.update(incoming_panel_access)
-        data["panelAccess"] = merged_panel_access
+    # El alias se completa en el cambio entrante para que sustituya a ambas claves guardadas
+    data = normalize_settings_aliases(await req.json())
     if isinstance(data.get("notifications"), dict):
         n = dict(data.get("notifications") or {})
         mail = dict(n.get("email") or {})
@@ -663,13 +669,43 @@ async def update_settings(req: Request):
             mail["smtpPassword"] = protect_secret(mail.get("smtpPassword") or "") or ""
             n["email"] = mail
             data["notifications"] = n
-    current.update(data)
-    settings_config.write(current)
-    return {"ok": True, "settings": current}
+
+    def _merge(current: Dict[str, Any]) -> Dict[str, Any]:
+        # La contraseña del panel se gestiona por endpoint dedicado
+        if isinstance(data.get("panelAccess"), dict):
+            incoming_panel_access = {
+                k: v for k, v in data["panelAccess"].items()
+                if k not in {"passwordBlob", "configured", "requiresAuth", "authenticated"}
+            }
+            merged_panel_access = dict(current.get("panelAccess") or {})
+            merged_panel_access.update(incoming_panel_access)
+            data["panelAccess"] = merged_panel_access
+        current.update(data)
+        return current
+
+    # Leer-modificar-escribir en una sola transacción: se serializa con el resto de escrituras de settings
+    saved = await asyncio.to_thread(settings_config.atomic_update, _merge)
+    return {"ok": True, "settings": saved}
+
+def _cached_log_files() -> List[str]:
+    global _log_files_cache
+    now = time.monotonic()
+    cached = _log_files_cache
+    if cached is not None and now - cached[0] < LOG_FILES_CACHE_TTL_SECONDS:
+        return cached[2]
+    try:
+        dir_mtime = LOGS_DIR.stat().st_mtime_ns
+    except OSError:
+        dir_mtime = 0
+    # Solo cuenta la lista de nombres: si el directorio no cambió no hace falta volver a recorrerlo
+    files = cached[2] if cached is not None and cached[1] == dir_mtime else get_log_files()
+    _log_files_cache = (now, dir_mtime, files)
+    return files
+
 
 @router.get("/api/config/logs")
 async def list_logs():
-    return {"ok": True, "files": get_log_files()}
+    return {"ok": True, "files": await _run_local_fs(_cached_log_files)}
 
 @router.get("/api/config/logs/{filename}/query")
 async def query_log(
@@ -683,7 +719,7 @@ async def query_log(
     date_to: Optional[str] = None,
     reverse: bool = True,
 ):
-    content = read_log_file(filename)
+    content = await _run_local_fs(read_log_file, filename)
     if content is None:
         raise HTTPException(status_code=404, detail="Log file not found")
 
@@ -737,7 +773,7 @@ async def export_log_filtered(
     date_to: Optional[str] = None,
     reverse: bool = True,
 ):
-    content = read_log_file(filename)
+    content = await _run_local_fs(read_log_file, filename)
     if content is None:
         raise HTTPException(status_code=404, detail="Log file not found")
     raw_lines = [ln for ln in str(content).splitlines() if ln.strip()]
@@ -758,9 +794,64 @@ async def export_log_filtered(
     }
     return PlainTextResponse(content=body, headers=headers)
 
+def _parse_byte_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """(inicio, fin inclusive) de un `Range: bytes=a-b`; None si la cabecera no se entiende (se sirve entero)."""
+    m = BYTE_RANGE_RE.match(str(header or "").strip())
+    if not m or not (m.group(1) or m.group(2)):
+        return None
+    if m.group(1):
+        start = int(m.group(1))
+        end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+    else:
+        # bytes=-N: los últimos N bytes (cola del log)
+        start = max(0, size - int(m.group(2)))
+        end = size - 1
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="Rango no válido", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+def _iter_file_range(path: Path, start: int, length: int) -> Iterator[bytes]:
+    with open(path, "rb") as fh:
+        fh.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = fh.read(min(LOG_STREAM_CHUNK_BYTES, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+@router.get("/api/config/logs/{filename}/raw")
+async def stream_log(filename: str, request: Request):
+    """Log en texto plano por bloques, con soporte de Range para leer solo la cola o lo nuevo."""
+    path = await _run_local_fs(resolve_log_path, filename)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Log file not found")
+    # Se fija el tamaño al empezar: lo que se añada después se pide en la siguiente lectura
+    size = (await _run_local_fs(path.stat)).st_size
+    headers = {"Accept-Ranges": "bytes"}
+    range_header = request.headers.get("range")
+    byte_range = _parse_byte_range(range_header, size) if range_header else None
+    if byte_range is None:
+        start, end, status_code = 0, size - 1, 200
+    else:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    length = max(0, end - start + 1)
+    headers["Content-Length"] = str(length)
+    return StreamingResponse(
+        _iter_file_range(path, start, length),
+        status_code=status_code,
+        media_type="text/plain; charset=utf-8",
+        headers=headers,
+    )
+
 @router.get("/api/config/logs/{filename}")
 async def read_log(filename: str):
-    content = read_log_file(filename)
+    content = await _run_local_fs(read_log_file, filename)
     if content is None:
         raise HTTPException(status_code=404, detail="Log file not found")
     return {"ok": True, "content": content}
@@ -770,6 +861,9 @@ async def read_log(filename: str):
 async def on_startup():
     global scheduler_task
     if scheduler_task is None or scheduler_task.done():
+        if not acquire_scheduler_lock():
+            logger.info("[Scheduler] Otro proceso ya ejecuta el scheduler; este no lo inicia")
+            return
         scheduler_task = asyncio.create_task(scheduler_loop())
 
 
@@ -10,6 +10,7 @@ import asyncio
 import re
 import threading
 import urllib.request
+from collections import deque
 from pathlib import Path
 from typing import Optional, Callable, Dict, Any, List
 from server_py.utils.logger import get_logger
@@ -20,6 +21,39 @@ logger = get_logger("DuplicacyCLI")
 
 DUPLICACY_GITHUB_RELEASE_LATEST_API = "https://api.github.com/repos/gilbertchen/duplicacy/releases/latest"
 DUPLICACY_DOWNLOAD_USER_AGENT = "DupliManager-AutoDownload"
+# Tamaño de lectura de la salida de duplicacy (se parte en líneas en memoria).
+STDOUT_READ_CHUNK_BYTES = 64 * 1024
+
+# Patrones de parseo compilados una sola vez (la salida de `list` es texto, no JSON).
+# Patrón: Snapshot <id> revision <rev> created at <datetime> ...
+_SNAPSHOT_LINE_RE = re.compile(r"Snapshot\s+(\S+)\s+revision\s+(\d+)\s+created\s+at\s+(.+)", re.IGNORECASE)
+# Newer format: <size> <date> <time> <hash> <path>
+_FILE_LINE_WITH_HASH_RE = re.compile(
+    r"^\s*\d+\s+\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2}\s+[0-9a-f]{32,128}\s+(.+)$",
+    re.IGNORECASE,
+)
+# Older format: <size> <date> <time> <path>   (no hash column)
+_FILE_LINE_NO_HASH_RE = re.compile(
+    r"^\s*\d+\s+\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2}\s+(.+)$",
+    re.IGNORECASE,
+)
+_FILE_LINE_FALLBACK_RE = re.compile(r"^.*\s([0-9a-f]{32,128})\s+(.+)$", re.IGNORECASE)
+_FILE_LIST_SKIP_PREFIXES = (
+    "snapshot ",
+    "listing ",
+    "storage set to",
+    "files:",
+    "total size:",
+    "listing all chunks",
+    "chunks:",
+)
+
+
+def _tail_lines(text: str, max_lines: Optional[int]) -> str:
+    """Últimas max_lines líneas de text (todo si max_lines es None)."""
+    if not max_lines:
+        return text
+    return "\n".join(text.splitlines()[-max_lines:])
 
 class DuplicacyService:
     def __init__(self):
@@ -120,8 +154,13 @@ class DuplicacyService:
         env: Optional[Dict[str, str]] = None,
         on_progress: Optional[Callable[[str], None]] = None,
         on_process_start: Optional[Callable[[Any], None]] = None,
+        max_stdout_lines: Optional[int] = None,
     ) -> Dict[str, Any]:
-        """Ejecuta un comando duplicacy y captura la salida."""
+        """Ejecuta un comando duplicacy y captura la salida.
+
+        Con max_stdout_lines solo se retienen las últimas N líneas en "stdout"; útil cuando
+        on_progress ya consume la salida completa y no hace falta duplicarla en memoria.
+        """
         binary_ok = await self._ensure_binary_available()
         binary_path = str(self._binary_path_obj())
         if not binary_ok:
@@ -138,6 +177,7 @@ class DuplicacyService:
         if env:
             full_env.update(env)
 
+        process = None
         try:
             creationflags = subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
 
@@ -155,14 +195,25 @@ class DuplicacyService:
             if on_process_start:
                 on_process_start(process)
 
-            stdout_content = []
+            stdout_content = deque(maxlen=max_stdout_lines) if max_stdout_lines else []
             
             if process.stdout:
+                # Se lee por bloques y se parte en líneas: un await por bloque en vez de uno por
+                # línea (restores con miles de líneas por segundo) y sin límite de longitud de línea.
+                pending = b""
                 while True:
-                    line_bytes = await process.stdout.readline()
-                    if not line_bytes:
+                    chunk = await process.stdout.read(STDOUT_READ_CHUNK_BYTES)
+                    if not chunk:
                         break
-                    decoded_line = line_bytes.decode("utf-8", errors="replace")
+                    lines = (pending + chunk).split(b"\n")
+                    pending = lines.pop()
+                    for line_bytes in lines:
+                        decoded_line = line_bytes.decode("utf-8", errors="replace") + "\n"
+                        stdout_content.append(decoded_line)
+                        if on_progress:
+                            on_progress(decoded_line)
+                if pending:
+                    decoded_line = pending.decode("utf-8", errors="replace")
                     stdout_content.append(decoded_line)
                     if on_progress:
                         on_progress(decoded_line)
@@ -177,6 +228,11 @@ class DuplicacyService:
                 "stderr": ""
             }
 
+        except asyncio.CancelledError:
+            # La tarea que esperaba el resultado se canceló: no dejar el proceso huérfano.
+            if process is not None and process.returncode is None:
+                process.kill()
+            raise
         except Exception as e:
             logger.error(f"Error ejecutando proceso: {str(e)}")
             return {
@@ -243,6 +299,7 @@ class DuplicacyService:
         storage_name: Optional[str] = None,
         extra_env: Optional[Dict[str, str]] = None,
         on_process_start: Optional[Callable[[Any], None]] = None,
+        max_stdout_lines: Optional[int] = None,
     ):
         args = ["backup", "-stats"]
         if storage_name:
@@ -254,7 +311,14 @@ class DuplicacyService:
         if extra_env:
             env.update(extra_env)
 
-        return await self.exec(args, repo_path, env=env, on_progress=on_progress, on_process_start=on_process_start)
+        return await self.exec(
+            args,
+            repo_path,
+            env=env,
+            on_progress=on_progress,
+            on_process_start=on_process_start,
+            max_stdout_lines=max_stdout_lines,
+        )
 
     async def copy(
         self,
@@ -265,12 +329,20 @@ class DuplicacyService:
         on_progress: Optional[Callable[[str], None]] = None,
         extra_env: Optional[Dict[str, str]] = None,
         on_process_start: Optional[Callable[[Any], None]] = None,
+        max_stdout_lines: Optional[int] = None,
     ):
         args = ["copy", "-from", from_storage, "-to", to_storage]
         env = self._build_password_env(password, to_storage or "default")
         if extra_env:
             env.update(extra_env)
-        return await self.exec(args, repo_path, env=env, on_progress=on_progress, on_process_start=on_process_start)
+        return await self.exec(
+            args,
+            repo_path,
+            env=env,
+            on_progress=on_progress,
+            on_process_start=on_process_start,
+            max_stdout_lines=max_stdout_lines,
+        )
 
     async def list_snapshots(
         self,
@@ -324,6 +396,7 @@ class DuplicacyService:
         patterns: Optional[List[str]] = None,
         threads: Optional[int] = None,
         on_process_start: Optional[Callable[[Any], None]] = None,
+        max_stdout_lines: Optional[int] = None,
     ):
         args = ["restore", "-r", str(revision)]
         if storage_name:
@@ -348,6 +421,7 @@ class DuplicacyService:
                     env=env,
                     on_progress=on_progress,
                     on_process_start=on_process_start,
+                    max_stdout_lines=max_stdout_lines,
                 )
 
             max_cmd_chars = 20000  # margen conservador por debajo del límite de Windows
@@ -384,6 +458,7 @@ class DuplicacyService:
                     env=env,
                     on_progress=on_progress,
                     on_process_start=on_process_start,
+                    max_stdout_lines=max_stdout_lines,
                 )
                 out = str(last_result.get("stdout") or "")
                 if out:
@@ -391,13 +466,13 @@ class DuplicacyService:
                 if int(last_result.get("code", -1)) != 0:
                     return {
                         "code": int(last_result.get("code", -1)),
-                        "stdout": "\n".join(combined_stdout).strip(),
+                        "stdout": _tail_lines("\n".join(combined_stdout).strip(), max_stdout_lines),
                         "stderr": str(last_result.get("stderr") or ""),
                     }
 
             return {
                 "code": 0,
-                "stdout": "\n".join(combined_stdout).strip(),
+                "stdout": _tail_lines("\n".join(combined_stdout).strip(), max_stdout_lines),
                 "stderr": "",
             }
 
@@ -407,6 +482,7 @@ class DuplicacyService:
             env=env,
             on_progress=on_progress,
             on_process_start=on_process_start,
+            max_stdout_lines=max_stdout_lines,
         )
 
 
@@ -414,11 +490,9 @@ class DuplicacyService:
 
     def _parse_list_output(self, stdout: str) -> List[Dict[str, Any]]:
         snapshots = []
-        # Patrón: Snapshot <id> revision <rev> created at <datetime> ...
-        regex = re.compile(r"Snapshot\s+(\S+)\s+revision\s+(\d+)\s+created\s+at\s+(.+)", re.IGNORECASE)
-
+        search = _SNAPSHOT_LINE_RE.search
         for line in stdout.splitlines():
-            match = regex.search(line)
+            match = search(line)
             if match:
                 snapshots.append({
                     "id": match.group(1),
@@ -429,33 +503,11 @@ class DuplicacyService:
 
     def _parse_file_list_output(self, stdout: str) -> List[Dict[str, Any]]:
         files: List[Dict[str, Any]] = []
-        # Newer format: <size> <date> <time> <hash> <path>
-        file_line_regex_with_hash = re.compile(
-            r"^\s*\d+\s+\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2}\s+[0-9a-f]{32,128}\s+(.+)$",
-            re.IGNORECASE,
-        )
-        # Older format: <size> <date> <time> <path>   (no hash column)
-        file_line_regex_no_hash = re.compile(
-            r"^\s*\d+\s+\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2}\s+(.+)$",
-            re.IGNORECASE,
-        )
         for raw in stdout.splitlines():
             line = raw.strip()
             if not line:
                 continue
-            if line.lower().startswith("snapshot "):
-                continue
-            if line.lower().startswith("listing "):
-                continue
-            if line.lower().startswith("storage set to"):
-                continue
-            if line.lower().startswith("files:"):
-                continue
-            if line.lower().startswith("total size:"):
-                continue
-            if line.lower().startswith("listing all chunks"):
-                continue
-            if line.lower().startswith("chunks:"):
+            if line.lower().startswith(_FILE_LIST_SKIP_PREFIXES):
                 continue
             if line.startswith("OPTIONS:") or line.startswith("USAGE:"):
                 continue
@@ -463,16 +515,16 @@ class DuplicacyService:
             # Formato típico de `duplicacy list -files`:
             # <size> <yyyy-mm-dd> <hh:mm:ss> <hash> <path>
             candidate = line
-            match = file_line_regex_with_hash.match(line)
+            match = _FILE_LINE_WITH_HASH_RE.match(line)
             if match and match.group(1).strip():
                 candidate = match.group(1).strip()
             else:
-                match_no_hash = file_line_regex_no_hash.match(line)
+                match_no_hash = _FILE_LINE_NO_HASH_RE.match(line)
                 if match_no_hash and match_no_hash.group(1).strip():
                     candidate = match_no_hash.group(1).strip()
                 else:
                 # Fallback conservador: tomar la parte tras la última secuencia hash larga.
-                    fallback = re.match(r"^.*\s([0-9a-f]{32,128})\s+(.+)$", line, re.IGNORECASE)
+                    fallback = _FILE_LINE_FALLBACK_RE.match(line)
                     if fallback and fallback.group(2).strip():
                         candidate = fallback.group(2).strip()
 
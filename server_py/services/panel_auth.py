@@ -121,7 +121,7 @@ def _pbkdf2_hash(password: str, salt: bytes) -> str:
 
 
 def _read_panel_access_cfg() -> Dict[str, Any]:
-    s = settings_config.read() or {}
+    s = settings_config.read_shared() or {}
     pa = dict(s.get("panelAccess") or {})
     raw_cookie_mode = pa.get("cookieSecureMode")
     if raw_cookie_mode is None and "cookieSecure" in pa:
@@ -138,15 +138,22 @@ def _read_panel_access_cfg() -> Dict[str, Any]:
 
 
 def _write_panel_access_cfg(enabled: bool, password_blob: Optional[str]) -> Dict[str, Any]:
-    current = settings_config.read() or {}
-    pa = dict(current.get("panelAccess") or {})
-    pa["enabled"] = bool(enabled)
-    pa["sessionTtlSeconds"] = int(pa.get("sessionTtlSeconds") or SESSION_TTL_SECONDS)
-    if password_blob is not None:
-        pa["passwordBlob"] = str(password_blob or "").strip()
-    current["panelAccess"] = pa
-    settings_config.write(current)
-    return pa
+    saved: Dict[str, Any] = {}
+
+    def _apply(current: Dict[str, Any]) -> Dict[str, Any]:
+        current = current or {}
+        pa = dict(current.get("panelAccess") or {})
+        pa["enabled"] = bool(enabled)
+        pa["sessionTtlSeconds"] = int(pa.get("sessionTtlSeconds") or SESSION_TTL_SECONDS)
+        if password_blob is not None:
+            pa["passwordBlob"] = str(password_blob or "").strip()
+        current["panelAccess"] = pa
+        saved.update(pa)
+        return current
+
+    # Misma transacción que PUT /api/config/settings: ninguna de las dos pisa a la otra
+    settings_config.atomic_update(_apply)
+    return saved
 
 
 def _encode_password_verifier(password: str) -> str:
@@ -74,11 +74,12 @@ def migrate_all_secrets_in_config() -> Dict[str, Any]:
         "repositoriesRecordsMigrated": 0,
     }
 
-    settings_data = settings_config.read() or {}
-    new_settings, s_stats = _migrate_settings(settings_data)
-    summary.update(s_stats)
-    if new_settings != settings_data:
-        settings_config.write(new_settings)
+    def _apply_settings(settings_data: Dict[str, Any]) -> Dict[str, Any]:
+        new_settings, s_stats = _migrate_settings(settings_data or {})
+        summary.update(s_stats)
+        return new_settings
+
+    settings_config.atomic_update(_apply_settings)
 
     storages_data = storages_config.read() or []
     new_storages, st_stats = _migrate_storages(storages_data)
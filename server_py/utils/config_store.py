@@ -3,10 +3,15 @@ DupliManager — Config Store (SQLite V2)
 Gestión de configuración basada en SQLite para concurrencia segura.
 """
 
+import asyncio
+import copy
 import json
 import sqlite3
 import threading
-from typing import Any
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import orjson
 
 from server_py.utils.logger import get_logger
 from server_py.utils.paths import CONFIG_DIR, DEFAULT_DUPLICACY_EXE
@@ -14,6 +19,7 @@ from server_py.utils.paths import CONFIG_DIR, DEFAULT_DUPLICACY_EXE
 CONFIG_DIR.mkdir(exist_ok=True)
 
 DB_PATH = CONFIG_DIR / "duplimanager.db"
+DB_WAL_PATH = CONFIG_DIR / "duplimanager.db-wal"
 
 # Valores por defecto
 DEFAULTS = {
@@ -97,24 +103,172 @@ def _init_db():
 
 _init_db()
 
+
+def _loads(raw: str) -> Any:
+    # orjson acepta el mismo JSON que json.loads y es bastante más rápido con los blobs de config.
+    return orjson.loads(raw)
+
+
+def _dumps(data: Any) -> str:
+    # Mismo formato que json.dumps(indent=2, ensure_ascii=False), serializado con orjson.
+    return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+
+def _disk_token() -> Tuple[int, ...]:
+    """Huella barata de la BBDD para detectar escrituras de otros procesos.
+
+    Del WAL solo se usa el tamaño: SQLite lo recrea (nuevo mtime) al abrir conexiones de lectura.
+    """
+    parts = []
+    for path, with_mtime in ((DB_PATH, True), (DB_WAL_PATH, False)):
+        try:
+            st = path.stat()
+            parts.extend((st.st_mtime_ns if with_mtime else 0, st.st_size))
+        except OSError:
+            parts.extend((0, 0))
+    return tuple(parts)
+
+
+# Cada cuánto se vuelve a mirar el disco en busca de escrituras de otros procesos (CLI, otros workers).
+DISK_TOKEN_CHECK_INTERVAL_SECONDS = 1.0
+_disk_token_cache: Optional[Tuple[float, Tuple[int, ...]]] = None
+
+
+def _recent_disk_token(refresh: bool = False) -> Tuple[int, ...]:
+    """_disk_token() cacheado DISK_TOKEN_CHECK_INTERVAL_SECONDS (compartido por todos los stores: misma BBDD)."""
+    global _disk_token_cache
+    now = time.monotonic()
+    cached = _disk_token_cache
+    if not refresh and cached is not None and now - cached[0] < DISK_TOKEN_CHECK_INTERVAL_SECONDS:
+        return cached[1]
+    token = _disk_token()
+    _disk_token_cache = (now, token)
+    return token
+
+
+def normalize_settings_aliases(data: Any) -> Any:
+    """Mantiene a la par los alias duplicacyPath (UI) y duplicacy_path (servicio). Modifica data in situ."""
+    if isinstance(data, dict):
+        if "duplicacyPath" in data and "duplicacy_path" not in data:
+            data["duplicacy_path"] = data["duplicacyPath"]
+        elif "duplicacy_path" in data and "duplicacyPath" not in data:
+            data["duplicacyPath"] = data["duplicacy_path"]
+    return data
+
+
 class ConfigStore:
-    """Almacén de config SQLite con lectura/escritura thread-safe."""
+    """Almacén de config SQLite con lectura/escritura thread-safe.
+
+    normalize: función opcional aplicada al escribir y al construir la vista compartida de cada versión.
+    """
 
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, normalize: Optional[Callable[[Any], Any]] = None):
         self.filename = filename
+        self._normalize = normalize
+        self._version = 0
+        self._version_lock = threading.Lock()
+        self._disk_token = _recent_disk_token()
+        self._map_cache: Any = None
+        self._index_cache: Dict[str, Tuple[Any, Dict[Any, Any]]] = {}
+        # (versión, JSON en texto) del último contenido leído/escrito: evita reabrir SQLite si no cambió.
+        self._raw_cache: Optional[Tuple[int, str]] = None
+        self._pending_updates: List[Tuple[Any, asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+
+    @property
+    def version(self) -> int:
+        """Contador que cambia con cada escritura propia al instante y con las de otros procesos
+        (p.ej. el CLI de mantenimiento) como mucho DISK_TOKEN_CHECK_INTERVAL_SECONDS después.
+        """
+        token = _recent_disk_token()
+        if token == self._disk_token:
+            return self._version
+        with self._version_lock:
+            if token != self._disk_token:
+                self._disk_token = token
+                self._version += 1
+            return self._version
+
+    def _bump_version(self) -> None:
+        token = _recent_disk_token(refresh=True)
+        with self._version_lock:
+            self._disk_token = token
+            self._version += 1
 
     def read(self) -> Any:
-        """Lee y retorna la config."""
+        """Lee y retorna la config (copia nueva en cada llamada, se puede modificar)."""
+        cached = self._cached_raw()
+        if cached is not None:
+            return self._parse(cached)
+        version = self.version
         with _db_lock:
             with sqlite3.connect(DB_PATH, timeout=10.0) as conn:
                 cursor = conn.execute("SELECT data FROM config_store WHERE filename = ?", (self.filename,))
                 row = cursor.fetchone()
-                if row:
-                    try:
-                        return json.loads(row[0])
-                    except json.JSONDecodeError:
-                        return DEFAULTS.get(self.filename, {})
-                return DEFAULTS.get(self.filename, {})
+        if not row:
+            return DEFAULTS.get(self.filename, {})
+        self._raw_cache = (version, row[0])
+        return self._parse(row[0])
+
+    def _cached_raw(self) -> Optional[str]:
+        cached = self._raw_cache
+        if cached is not None and cached[0] == self.version:
+            return cached[1]
+        return None
+
+    def _parse(self, raw: str) -> Any:
+        try:
+            return _loads(raw)
+        except orjson.JSONDecodeError:
+            return DEFAULTS.get(self.filename, {})
+
+    def read_as_map(self, key: str = "id") -> Tuple[Any, Dict[str, Any]]:
+        """Lista + índice key->elemento, construidos una vez por versión.
+
+        Ambos son compartidos entre llamadas: tratarlos como solo lectura (para modificar, usar read()).
+        """
+        version = self.version
+        cached = self._map_cache
+        if cached is not None and cached[0] == version and cached[1] == key:
+            return cached[2], cached[3]
+        data = self.read()
+        if self._normalize is not None:
+            data = self._normalize(data)
+        index: Dict[str, Any] = {}
+        if isinstance(data, list):
+            index = {item[key]: item for item in data if isinstance(item, dict) and item.get(key)}
+        self._map_cache = (version, key, data, index)
+        return data, index
+
+    def read_shared(self) -> Any:
+        """Config parseada una vez por versión (la misma instancia que read_as_map): solo lectura, para modificar usar read()."""
+        return self.read_as_map()[0]
+
+    def read_index(self, name: str, key_fn: Callable[[Any], Any]) -> Tuple[Any, Dict[Any, Any]]:
+        """Como read_as_map pero con un índice secundario key_fn(elemento)->elemento (primer elemento por clave).
+
+        Se cachea por `name` mientras no cambie la lista; ambos son de solo lectura.
+        """
+        data, _ = self.read_as_map()
+        cached = self._index_cache.get(name)
+        if cached is not None and cached[0] is data:
+            return data, cached[1]
+        index: Dict[Any, Any] = {}
+        if isinstance(data, list):
+            for item in data:
+                if isinstance(item, dict):
+                    index_key = key_fn(item)
+                    if index_key is not None and index_key not in index:
+                        index[index_key] = item
+        self._index_cache[name] = (data, index)
+        return data, index
+
+    def peek_map(self, key: str = "id") -> Optional[Tuple[Any, Dict[str, Any]]]:
+        """Vista de read_as_map si sigue vigente, sin tocar SQLite; None si hay que recargar."""
+        cached = self._map_cache
+        if cached is not None and cached[0] == self.version and cached[1] == key:
+            return cached[2], cached[3]
+        return None
 
     def write(self, data: Any):
         """Escribe la config completa con validación de integridad."""
@@ -122,11 +276,13 @@ class ConfigStore:
             logger.error(f"[ConfigStore] Intento de escribir datos no estructurados en {self.filename}: {type(data)}")
             return
 
+        if self._normalize is not None:
+            data = self._normalize(data)
         try:
             # Serializar y validar que el resultado es un JSON válido
-            json_str = json.dumps(data, indent=2, ensure_ascii=False)
+            json_str = _dumps(data)
             # Doble comprobación de seguridad: intentar cargar lo que acabamos de serializar
-            json.loads(json_str)
+            orjson.loads(json_str)
         except (TypeError, ValueError) as e:
             logger.error(f"[ConfigStore] Error de serialización en {self.filename}: {e}")
             return
@@ -138,6 +294,8 @@ class ConfigStore:
                     (json_str, self.filename)
                 )
                 conn.commit()
+            self._bump_version()
+            self._raw_cache = (self._version, json_str)
                 
         # Guardar también el JSON en modo sólo lectura (backup)
         try:
@@ -146,6 +304,42 @@ class ConfigStore:
             logger.error(f"[ConfigStore] No se pudo escribir archivo de backup {self.filename}: {e}")
 
 
+    def update_one(self, item_id: str, item: Dict[str, Any], key: str = "id") -> bool:
+        """Sustituye el elemento de la lista con key == item_id. No escribe si no ha cambiado.
+
+        La sustitución va por atomic_update, así que no pisa escrituras concurrentes de otros elementos.
+        Retorna True si se escribió. Lanza KeyError si el elemento no existe.
+        """
+        current = self.read_as_map(key)[1].get(item_id)
+        if current is None:
+            raise KeyError(item_id)
+        if current is item or _dumps(current) == _dumps(item):
+            return False
+
+        def _replace(data: Any) -> Any:
+            idx = next((i for i, entry in enumerate(data) if isinstance(entry, dict) and entry.get(key) == item_id), None)
+            if idx is None:
+                raise KeyError(item_id)
+            data[idx] = item
+            return data
+
+        self.atomic_update(_replace)
+        return True
+
+    def delete_one(self, item_id: str, key: str = "id") -> Optional[Dict[str, Any]]:
+        """Elimina el elemento con key == item_id (vía atomic_update) y lo retorna (None si no existía, sin escribir)."""
+        if self.read_as_map(key)[1].get(item_id) is None:
+            return None
+        removed: List[Dict[str, Any]] = []
+
+        def _remove(data: Any) -> Any:
+            removed.extend(entry for entry in data if isinstance(entry, dict) and entry.get(key) == item_id)
+            return [entry for entry in data if not (isinstance(entry, dict) and entry.get(key) == item_id)]
+
+        self.atomic_update(_remove)
+        return removed[0] if removed else None
+
+
     def update(self, key: str, value: Any) -> Any:
         """Actualiza un valor usando dot notation."""
         # Se lee de la BBDD, se modifica en RAM y se vuelve a escribir atómicamente en un lock.
@@ -153,7 +347,7 @@ class ConfigStore:
             with sqlite3.connect(DB_PATH, timeout=10.0) as conn:
                 cursor = conn.execute("SELECT data FROM config_store WHERE filename = ?", (self.filename,))
                 row = cursor.fetchone()
-                data = json.loads(row[0]) if row else DEFAULTS.get(self.filename, {})
+                data = _loads(row[0]) if row else DEFAULTS.get(self.filename, {})
                 
                 keys = key.split(".")
                 obj = data
@@ -163,12 +357,14 @@ class ConfigStore:
                     obj = obj[k]
                 obj[keys[-1]] = value
                 
-                json_str = json.dumps(data, indent=2, ensure_ascii=False)
+                json_str = _dumps(data)
                 conn.execute(
                     "UPDATE config_store SET data = ? WHERE filename = ?",
                     (json_str, self.filename)
                 )
                 conn.commit()
+            self._bump_version()
+            self._raw_cache = (self._version, json_str)
                 
         # Respaldo JSON asíncrono secundario
         try:
@@ -186,22 +382,26 @@ class ConfigStore:
                 # 1. Leer
                 cursor = conn.execute("SELECT data FROM config_store WHERE filename = ?", (self.filename,))
                 row = cursor.fetchone()
-                data = json.loads(row[0]) if row else DEFAULTS.get(self.filename, [])
+                data = _loads(row[0]) if row else DEFAULTS.get(self.filename, [])
                 
                 # 2. Modificar via callback
                 new_data = callback(data)
+                if self._normalize is not None:
+                    new_data = self._normalize(new_data)
                 
                 # 3. Validar y Escribir
                 if not isinstance(new_data, (list, dict)):
                     logger.error(f"[ConfigStore] atomic_update rechazada: {type(new_data)} en {self.filename}")
                     return data
 
-                json_str = json.dumps(new_data, indent=2, ensure_ascii=False)
+                json_str = _dumps(new_data)
                 conn.execute(
                     "UPDATE config_store SET data = ? WHERE filename = ?",
                     (json_str, self.filename)
                 )
                 conn.commit()
+                self._bump_version()
+                self._raw_cache = (self._version, json_str)
                 
                 # Respaldo JSON asíncrono secundario
                 try:
@@ -211,9 +411,73 @@ class ConfigStore:
                     
                 return new_data
 
+    async def atomic_update_debounced(self, callback: Any, delay: float = 0.25) -> Any:
+        """atomic_update que agrupa en una sola escritura los callbacks recibidos dentro de `delay` segundos.
+
+        Pensado para ráfagas (p.ej. varios backups del scheduler terminando a la vez). Retorna los
+        datos escritos; si el callback falla, la excepción se propaga solo a su llamador.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending_updates.append((callback, future))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._flush_pending_updates(delay))
+        return await future
+
+    async def _flush_pending_updates(self, delay: float) -> None:
+        # Se drena hasta vaciar la cola: lo encolado mientras se escribía el lote anterior va en otro lote
+        # (atomic_update_debounced no crea otra tarea mientras esta siga viva).
+        try:
+            while True:
+                await asyncio.sleep(delay)
+                batch, self._pending_updates = self._pending_updates, []
+                if not batch:
+                    return
+                await self._write_batch(batch)
+        except asyncio.CancelledError:
+            for _, future in self._pending_updates:
+                if not future.done():
+                    future.cancel()
+            self._pending_updates = []
+            raise
+
+    async def _write_batch(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        errors: Dict[int, BaseException] = {}
+
+        def apply_all(data):
+            for idx, (callback, _) in enumerate(batch):
+                # Cada callback trabaja sobre una copia: si falla a medias no deja cambios parciales
+                try:
+                    new_data = callback(copy.deepcopy(data))
+                except Exception as exc:
+                    errors[idx] = exc
+                    continue
+                if isinstance(new_data, (list, dict)):
+                    data = new_data
+                else:
+                    errors[idx] = TypeError(f"atomic_update rechazada: {type(new_data)} en {self.filename}")
+            return data
+
+        try:
+            written = await asyncio.to_thread(self.atomic_update, apply_all)
+        except Exception as exc:
+            logger.error(f"[ConfigStore] Falló escritura agrupada en {self.filename}: {exc}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        for idx, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if idx in errors:
+                future.set_exception(errors[idx])
+            else:
+                future.set_result(written)
+
 
 # ─── Singletons ──────────────────────────────────────
-settings = ConfigStore("settings.json")
+settings = ConfigStore("settings.json", normalize=normalize_settings_aliases)
 repositories = ConfigStore("repositories.json")
 storages = ConfigStore("storages.json")
 schedules = ConfigStore("schedules.json")
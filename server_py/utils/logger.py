@@ -7,6 +7,7 @@ import os
 import logging
 import re
 from datetime import datetime
+from pathlib import Path
 
 from server_py.utils.paths import LOGS_DIR
 
@@ -54,8 +55,8 @@ def get_log_files() -> list[str]:
     )
 
 
-def read_log_file(filename: str) -> str | None:
-    """Lee el contenido de un archivo de log."""
+def resolve_log_path(filename: str) -> Path | None:
+    """Ruta del log dentro de LOGS_DIR si el nombre es válido y existe; None en otro caso."""
     name = str(filename or "").strip()
     if not SAFE_LOG_FILENAME_RE.fullmatch(name):
         return None
@@ -69,4 +70,12 @@ def read_log_file(filename: str) -> str | None:
 
     if filepath.parent != logs_root or not filepath.exists() or not filepath.is_file():
         return None
+    return filepath
+
+
+def read_log_file(filename: str) -> str | None:
+    """Lee el contenido de un archivo de log."""
+    filepath = resolve_log_path(filename)
+    if filepath is None:
+        return None
     return filepath.read_text(encoding="utf-8")
@@ -12,6 +12,9 @@ from __future__ import annotations
 import base64
 import ctypes
 import ctypes.wintypes as wintypes
+import hashlib
+import threading
+from collections import OrderedDict
 from typing import Any, Dict, Optional
 
 from server_py.utils.logger import get_logger
@@ -21,6 +24,11 @@ logger = get_logger("SecretCrypto")
 SECRET_PREFIX = "dpapi$"
 CRYPTPROTECT_UI_FORBIDDEN = 0x1
 CRYPTPROTECT_LOCAL_MACHINE = 0x4
+# Secretos ya descifrados (LRU). La clave es un hash del texto cifrado: un secreto nuevo
+# siempre produce otro texto cifrado, así que no hace falta invalidar al reescribir la config.
+REVEAL_CACHE_MAX_ENTRIES = 1000
+_reveal_cache: "OrderedDict[bytes, str]" = OrderedDict()
+_reveal_cache_lock = threading.Lock()
 
 
 class _DATA_BLOB(ctypes.Structure):
@@ -130,12 +138,24 @@ def reveal_secret(value: Any) -> Optional[str]:
     if not _is_windows():
         return text
     raw_b64 = text[len(SECRET_PREFIX):]
+    cache_key = hashlib.blake2b(raw_b64.encode("ascii", "replace"), digest_size=16).digest()
+    with _reveal_cache_lock:
+        cached = _reveal_cache.get(cache_key)
+        if cached is not None:
+            _reveal_cache.move_to_end(cache_key)
+            return cached
     try:
         raw = _dpapi_unprotect(base64.b64decode(raw_b64.encode("ascii")))
-        return raw.decode("utf-8")
+        revealed = raw.decode("utf-8")
     except Exception as ex:
+        # Los fallos no se cachean: se reintenta en la siguiente llamada.
         logger.warning("[SecretCrypto] No se pudo descifrar secreto DPAPI: %s", ex)
         return None
+    with _reveal_cache_lock:
+        _reveal_cache[cache_key] = revealed
+        if len(_reveal_cache) > REVEAL_CACHE_MAX_ENTRIES:
+            _reveal_cache.popitem(last=False)
+    return revealed
 
 
 def _is_secret_field_name(field_name: str) -> bool:
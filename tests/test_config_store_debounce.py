@@ -0,0 +1,72 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from server_py.utils.config_store import ConfigStore
+
+
+class _MemoryStore(ConfigStore):
+    """ConfigStore con atomic_update en memoria y una escritura lenta, sin tocar SQLite."""
+
+    def __init__(self, write_seconds: float = 0.1):
+        super().__init__("test-debounce.json")
+        self.data = [{"id": "a", "n": 0}]
+        self.writes = 0
+        self.write_seconds = write_seconds
+        self.writing = threading.Event()
+
+    def atomic_update(self, callback):
+        self.writing.set()
+        time.sleep(self.write_seconds)
+        self.data = callback(self.data)
+        self.writes += 1
+        return self.data
+
+
+def _bump(data):
+    data[0]["n"] += 1
+    return data
+
+
+class TestAtomicUpdateDebounced(unittest.TestCase):
+
+    def test_update_queued_during_flush_is_written(self):
+        store = _MemoryStore()
+
+        async def scenario():
+            first = asyncio.ensure_future(store.atomic_update_debounced(_bump, delay=0.01))
+            # Esperar a que el primer lote esté escribiéndose en el hilo
+            while not store.writing.is_set():
+                await asyncio.sleep(0.005)
+            second = asyncio.ensure_future(store.atomic_update_debounced(_bump, delay=0.01))
+            return await asyncio.wait_for(asyncio.gather(first, second), timeout=2)
+
+        first, second = asyncio.run(scenario())
+        self.assertEqual(first[0]["n"], 1)
+        self.assertEqual(second[0]["n"], 2)
+        self.assertEqual(store.writes, 2)
+        self.assertEqual(store._pending_updates, [])
+
+    def test_failing_callback_leaves_no_partial_changes(self):
+        store = _MemoryStore(write_seconds=0)
+
+        def partial_then_fail(data):
+            data[0]["n"] = 99
+            raise ValueError("boom")
+
+        async def scenario():
+            return await asyncio.gather(
+                store.atomic_update_debounced(partial_then_fail, delay=0.01),
+                store.atomic_update_debounced(_bump, delay=0.01),
+                return_exceptions=True,
+            )
+
+        failed, written = asyncio.run(scenario())
+        self.assertIsInstance(failed, ValueError)
+        self.assertEqual(written[0]["n"], 1)
+        self.assertEqual(store.writes, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+from unittest.mock import patch
+
+from server_py.utils import config_store
+from server_py.utils.config_store import ConfigStore
+
+
+class _ListStore(ConfigStore):
+    """ConfigStore de lista en memoria que cuenta escrituras, sin tocar SQLite."""
+
+    def __init__(self, items):
+        super().__init__("test-items.json")
+        self.items = items
+        self.writes = 0
+        self._mem_version = 0
+
+    @property
+    def version(self) -> int:
+        return self._mem_version
+
+    def read(self):
+        return [dict(item) for item in self.items]
+
+    def write(self, data):
+        self.items = data
+        self.writes += 1
+        self._mem_version += 1
+
+    def atomic_update(self, callback):
+        self.write(callback(self.read()))
+        return self.items
+
+
+class TestUpdateOne(unittest.TestCase):
+
+    def setUp(self):
+        self.store = _ListStore([{"id": "a", "name": "A"}, {"id": "b", "name": "B"}])
+
+    def test_unchanged_item_skips_write(self):
+        self.assertFalse(self.store.update_one("a", {"id": "a", "name": "A"}))
+        self.assertEqual(self.store.writes, 0)
+
+    def test_changed_item_is_written_in_place(self):
+        self.assertTrue(self.store.update_one("b", {"id": "b", "name": "B2"}))
+        self.assertEqual(self.store.writes, 1)
+        self.assertEqual(self.store.items, [{"id": "a", "name": "A"}, {"id": "b", "name": "B2"}])
+
+    def test_missing_item_raises_key_error(self):
+        with self.assertRaises(KeyError):
+            self.store.update_one("zzz", {"id": "zzz"})
+        self.assertEqual(self.store.writes, 0)
+
+    def test_update_keeps_concurrent_changes_to_other_items(self):
+        self.store.read_as_map()
+        # Otro escritor cambia "a" después de que se construyera la vista compartida
+        self.store.items = [{"id": "a", "name": "A-otro"}, {"id": "b", "name": "B"}]
+        self.assertTrue(self.store.update_one("b", {"id": "b", "name": "B2"}))
+        self.assertEqual(self.store.items, [{"id": "a", "name": "A-otro"}, {"id": "b", "name": "B2"}])
+
+    def test_delete_one_missing_item_skips_write(self):
+        self.assertIsNone(self.store.delete_one("zzz"))
+        self.assertEqual(self.store.delete_one("a"), {"id": "a", "name": "A"})
+        self.assertEqual(self.store.writes, 1)
+
+
+class TestVersionDiskCheck(unittest.TestCase):
+
+    def setUp(self):
+        self.token = (1, 1, 0, 0)
+        self.stats = 0
+        self.now = 100.0
+
+        def fake_disk_token():
+            self.stats += 1
+            return self.token
+
+        for p in (
+            patch.object(config_store, "_disk_token", fake_disk_token),
+            patch.object(config_store, "_disk_token_cache", None),
+            patch.object(config_store.time, "monotonic", lambda: self.now),
+        ):
+            p.start()
+            self.addCleanup(p.stop)
+        self.store = ConfigStore("test-version.json")
+
+    def test_repeated_access_reuses_the_disk_check(self):
+        self.stats = 0
+        versions = {self.store.version for _ in range(50)}
+        self.assertEqual(versions, {0})
+        self.assertEqual(self.stats, 0)
+
+    def test_external_change_is_seen_after_the_interval(self):
+        self.token = (2, 1, 0, 0)
+        self.assertEqual(self.store.version, 0)
+        self.now += config_store.DISK_TOKEN_CHECK_INTERVAL_SECONDS
+        self.assertEqual(self.store.version, 1)
+        self.assertEqual(self.store.version, 1)
+
+    def test_own_write_bumps_immediately(self):
+        self.store._bump_version()
+        self.assertEqual(self.store.version, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
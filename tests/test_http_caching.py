@@ -0,0 +1,82 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from fastapi import HTTPException
+
+from server_py.routers import storages as storages_router
+from server_py.routers.system import _parse_byte_range
+
+
+class TestParseByteRange(unittest.TestCase):
+
+    def test_explicit_and_open_ranges(self):
+        self.assertEqual(_parse_byte_range("bytes=0-99", 1000), (0, 99))
+        self.assertEqual(_parse_byte_range("bytes=900-", 1000), (900, 999))
+        # El fin se recorta al tamaño del fichero
+        self.assertEqual(_parse_byte_range("bytes=900-5000", 1000), (900, 999))
+
+    def test_suffix_range_returns_tail(self):
+        self.assertEqual(_parse_byte_range("bytes=-100", 1000), (900, 999))
+        self.assertEqual(_parse_byte_range("bytes=-5000", 1000), (0, 999))
+
+    def test_unparseable_header_serves_whole_file(self):
+        self.assertIsNone(_parse_byte_range("items=0-10", 1000))
+        self.assertIsNone(_parse_byte_range("bytes=-", 1000))
+
+    def test_unsatisfiable_range_is_416(self):
+        for header in ("bytes=1000-", "bytes=50-10"):
+            with self.assertRaises(HTTPException) as ctx:
+                _parse_byte_range(header, 1000)
+            self.assertEqual(ctx.exception.status_code, 416)
+            self.assertEqual(ctx.exception.headers["Content-Range"], "bytes */1000")
+
+
+class TestStoragesListingEtag(unittest.TestCase):
+
+    def setUp(self):
+        self.listing_calls = 0
+        storages_router._storages_listing = None
+
+        def fake_listing():
+            self.listing_calls += 1
+            return [{"id": "s1", "name": "Local"}]
+
+        patches = [
+            patch.object(storages_router, "storages_config", SimpleNamespace(version=3)),
+            patch.object(storages_router, "repositories_config", SimpleNamespace(version=7)),
+            patch.object(storages_router, "list_all_storages_for_ui", fake_listing),
+            patch.object(storages_router, "sanitize_storages_cached", lambda items: items),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.addCleanup(setattr, storages_router, "_storages_listing", None)
+
+    def _get(self, if_none_match=None):
+        headers = {"if-none-match": if_none_match} if if_none_match else {}
+        return asyncio.run(storages_router.get_storages(SimpleNamespace(headers=headers)))
+
+    def test_matching_etag_returns_304_without_building_listing(self):
+        first = self._get()
+        etag = first.headers["etag"]
+        self.assertEqual(first.status_code, 200)
+        second = self._get(etag)
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.headers["etag"], etag)
+        self.assertEqual(self.listing_calls, 1)
+
+    def test_body_reused_until_a_store_version_changes(self):
+        first = self._get()
+        self._get()
+        self.assertEqual(self.listing_calls, 1)
+        storages_router.repositories_config.version = 8
+        changed = self._get(first.headers["etag"])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers["etag"], first.headers["etag"])
+        self.assertEqual(self.listing_calls, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
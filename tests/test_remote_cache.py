@@ -0,0 +1,97 @@
+import asyncio
+import unittest
+
+from server_py.core.remote_cache import RemoteListCache, _remote_cache_key, single_flight
+
+
+class TestRemoteListCacheScopes(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = RemoteListCache({
+            _remote_cache_key("repo-snapshots", "r1", "a"): {"value": 1},
+            _remote_cache_key("repo-files", "r1", "b"): {"value": 2},
+            _remote_cache_key("repo-snapshots", "r2", "a"): {"value": 3},
+            _remote_cache_key("storage-revisions", "s1", "a"): {"value": 4},
+            _remote_cache_key("storage-files", "s1", "b"): {"value": 5},
+            _remote_cache_key("wasabi-snapshots", "r1"): {"value": 6},
+        })
+
+    def test_invalidate_repo_only_removes_that_repo(self):
+        self.assertEqual(self.cache.invalidate_repo("r1"), 2)
+        self.assertNotIn("repo-snapshots||r1||a", self.cache)
+        self.assertNotIn("repo-files||r1||b", self.cache)
+        self.assertIn("repo-snapshots||r2||a", self.cache)
+        # Claves sin ámbito (aunque compartan id) no se tocan
+        self.assertIn("wasabi-snapshots||r1", self.cache)
+        self.assertEqual(self.cache.invalidate_repo("r1"), 0)
+
+    def test_invalidate_storage_only_removes_that_storage(self):
+        self.assertEqual(self.cache.invalidate_storage("s1"), 2)
+        self.assertNotIn("storage-revisions||s1||a", self.cache)
+        self.assertNotIn("storage-files||s1||b", self.cache)
+        self.assertEqual(len(self.cache), 4)
+
+    def test_removed_keys_leave_the_index(self):
+        self.cache.pop("repo-snapshots||r1||a")
+        del self.cache["repo-files||r1||b"]
+        self.assertEqual(self.cache.invalidate_repo("r1"), 0)
+        self.cache["repo-files||r1||c"] = {"value": 7}
+        self.assertEqual(self.cache.invalidate_repo("r1"), 1)
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_concurrent_callers_share_one_fetch(self):
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"ok": True}
+
+        async def scenario():
+            return await asyncio.gather(*(single_flight("sf-share", fetch) for _ in range(3)))
+
+        results = asyncio.run(scenario())
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(r is results[0] for r in results))
+
+    def test_error_reaches_every_caller_and_key_is_released(self):
+        async def failing():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("boom")
+
+        async def ok():
+            return "second"
+
+        async def scenario():
+            results = await asyncio.gather(
+                single_flight("sf-error", failing),
+                single_flight("sf-error", failing),
+                return_exceptions=True,
+            )
+            return results, await single_flight("sf-error", ok)
+
+        results, retry = asyncio.run(scenario())
+        self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+        self.assertEqual(retry, "second")
+
+    def test_cancelled_caller_does_not_cancel_the_others(self):
+        async def fetch():
+            await asyncio.sleep(0.05)
+            return "done"
+
+        async def scenario():
+            first = asyncio.ensure_future(single_flight("sf-cancel", fetch))
+            second = asyncio.ensure_future(single_flight("sf-cancel", fetch))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await first
+            return await second
+
+        self.assertEqual(asyncio.run(scenario()), "done")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from server_py.core import helpers
+
+if os.name != "nt":
+    import fcntl
+
+
+@unittest.skipIf(os.name == "nt", "flock solo en POSIX")
+class TestSchedulerLock(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.lock_path = Path(tmp.name) / "scheduler.lock"
+        for p in (
+            patch.object(helpers, "SCHEDULER_LOCK_PATH", self.lock_path),
+            patch.object(helpers, "_scheduler_lock_file", None),
+        ):
+            p.start()
+            self.addCleanup(p.stop)
+
+    def _release(self):
+        if helpers._scheduler_lock_file is not None:
+            helpers._scheduler_lock_file.close()
+
+    def test_second_holder_is_refused(self):
+        # Otro proceso (otra descripción de fichero) ya tiene el lock
+        with open(self.lock_path, "a+b") as other:
+            fcntl.flock(other.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self.assertFalse(helpers.acquire_scheduler_lock())
+            self.assertIsNone(helpers._scheduler_lock_file)
+
+    def test_lock_is_kept_by_the_first_caller(self):
+        self.addCleanup(self._release)
+        self.assertTrue(helpers.acquire_scheduler_lock())
+        self.assertTrue(helpers.acquire_scheduler_lock())
+        with open(self.lock_path, "a+b") as other:
+            with self.assertRaises(OSError):
+                fcntl.flock(other.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+if __name__ == "__main__":
+    unittest.main()
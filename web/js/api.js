@@ -148,10 +148,19 @@ const API = {
     },
 
     async detectWasabiSnapshots(payload) {
-        return this._fetch('/system/detect-wasabi-snapshots', {
+        // La detección corre en segundo plano: se lanza el job y se consulta hasta que termina
+        const job = await this._fetch('/system/detect-wasabi-snapshots/jobs', {
             method: 'POST',
             body: JSON.stringify(payload)
         });
+        if (job.status === 'done') return job.result;
+        let delay = 500;
+        for (;;) {
+            await new Promise(resolve => setTimeout(resolve, delay));
+            const status = await this._fetch(`/system/detect-wasabi-snapshots/jobs/${encodeURIComponent(job.jobId)}`);
+            if (status.status === 'done') return status.result;
+            delay = Math.min(delay * 2, 2000);
+        }
     },
 
     async testNotificationChannels(payload) {